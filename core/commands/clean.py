@@ -5,6 +5,7 @@
 import logging
 import os
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 from core.commands.command import Command
 from core.exceptions import HabitatException
@@ -13,8 +14,10 @@ from core.utils import check_call, clean_temp_dirs, get_head_commit_id, git_root
 
 
 def clean_global_cache(_):
-    for subdir in ['git', 'objects']:
-        rmtree(os.path.join(GLOBAL_CACHE_DIR, subdir))
+    # subdirectories are independent, so remove them concurrently
+    subdirs = [os.path.join(GLOBAL_CACHE_DIR, subdir) for subdir in ['git', 'objects', 'commits']]
+    with ThreadPoolExecutor(max_workers=len(subdirs)) as executor:
+        list(executor.map(rmtree, subdirs))
 
 
 def clean_deps(root_dir):
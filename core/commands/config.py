@@ -2,6 +2,7 @@
 # Licensed under the Apache License Version 2.0 that can be found in the
 # LICENSE file in the root directory of this source tree.
 
+import json
 import logging
 import os
 
@@ -74,4 +75,5 @@ class Config(Command):
         if options.branch:
             solution_config['branch'] = options.branch
         with open(config_file_path, 'w+') as f:
-            f.write(f'solutions = {str([solution_config])}')
+            # all values are strings, so the JSON document is also valid python
+            f.write(f'solutions = {json.dumps([solution_config], indent=4)}\n')
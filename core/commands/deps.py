@@ -6,7 +6,6 @@ import os
 import string
 
 from core.commands.command import Command
-from core.components.solution import load_solutions
 from core.settings import COMPATIBLE_CHECK, DEFAULT_CONFIG_FILE_NAME
 from core.utils import git_root_dir
 
@@ -23,6 +22,20 @@ class PartialFormatter(string.Formatter):
             val = self.missing, field_name
         return val
 
+    def format_parsed(self, parsed, kwargs):
+        """format with the result of self.parse(format_string), so that a template is parsed only once."""
+        result = []
+        for literal_text, field_name, format_spec, conversion in parsed:
+            result.append(literal_text)
+            if field_name is not None:
+                obj, _ = self.get_field(field_name, (), kwargs)
+                obj = self.convert_field(obj, conversion)
+                if format_spec and '{' in format_spec:
+                    # expand nested fields like vformat does, e.g. '{name:>{width}}'
+                    format_spec = self.vformat(format_spec, (), kwargs)
+                result.append(self.format_field(obj, format_spec or ''))
+        return ''.join(result)
+
 
 class Deps(Command):
     name = 'deps'
@@ -76,23 +89,25 @@ class Deps(Command):
     ]
 
     async def run(self, options, *args, **kwargs):
+        # imported here so that commands without solutions don't load the dependency graph modules
+        from core.components.solution import load_solutions
+
         root_dir = os.path.abspath(options.root or git_root_dir())
         solution_file = os.path.join(root_dir, DEFAULT_CONFIG_FILE_NAME)
         solutions = load_solutions(
             root_dir, solution_file, ignore_non_existing=False, enable_version_checking=COMPATIBLE_CHECK
         )
 
+        targets = options.target.split(',') if options.target else [None]
+        name, dep_type, ignore_condition = options.name, options.type, options.ignore_condition
         for solution in solutions:
-            targets = options.target.split(',') if options.target else [None]
             solution.load_deps(root_dir, targets)
 
-            deps = solution.list_deps()
-            if options.name:
-                deps = [dep for dep in deps if options.name == dep.name]
-            if options.type:
-                deps = [dep for dep in deps if options.type == dep.type]
-            if not options.ignore_condition:
-                deps = [dep for dep in deps if dep.condition]
+            deps = [
+                dep for dep in solution.list_deps()
+                if (not name or name == dep.name) and (not dep_type or dep_type == dep.type) and
+                (ignore_condition or dep.condition)
+            ]
 
             if options.raw:
                 for dep in deps:
@@ -101,13 +116,10 @@ class Deps(Command):
                 for dep in deps:
                     print(dep.source_stamp)
             elif options.format:
+                formatter = PartialFormatter()
+                parsed = list(formatter.parse(options.format))
                 for dep in deps:
-                    formatter = PartialFormatter()
-                    format_string = options.format
-                    print(formatter.format(
-                        format_string,
-                        **dep.attributes
-                    ))
+                    print(formatter.format_parsed(parsed, dep.attributes))
             else:
                 tree_str = solution.get_pretty_dependency_tree()
                 print(f'Dependency tree:\n{tree_str}')
@@ -9,6 +9,31 @@ from core.common.key_value_storage import KeyValueStorage
 from core.exceptions import HabitatException
 from core.settings import USER_CONFIG_STORAGE_PATH
 
+_CONFIG_EXPR_RE = re.compile(r'\s*([^\s,=]+)=([^,]*?)\s*(?:,|$)')
+_NON_ASCII_RE = re.compile(r'[^\x00-\x7f]')
+
+
+def parse_config_expression(expression: str):
+    """
+    parse "aaa=bbb,ccc=ddd" into a dict, a key ends at the first "=", a value at the next "," and whitespace around
+    items is ignored. quotes have no special meaning, non-ascii characters are dropped.
+    """
+    configs = {}
+    pos = 0
+    for matches in _CONFIG_EXPR_RE.finditer(expression):
+        # finditer skips text that doesn't match, so a gap means an invalid expression
+        if matches.start() != pos:
+            break
+        key, value = tuple(_NON_ASCII_RE.sub('', s) for s in matches.groups())
+        configs[key] = value
+        pos = matches.end()
+    # like an empty item in the middle, a trailing "," is invalid
+    if pos != len(expression) or expression.endswith(','):
+        # report the text from the first character that could not be parsed, or from the trailing ","
+        pos = min(pos, len(expression) - 1)
+        raise HabitatException(f'Invalid expression {expression!r}, unexpected {expression[pos:]!r} at position {pos}')
+    return configs
+
 
 class Setup(Command):
     name = 'setup'
@@ -40,12 +65,7 @@ class Setup(Command):
             return
 
         if options.configs:
-            for expr in options.configs.split(','):
-                matches = re.match(r'^(\S+)=(.*)$', expr.strip())
-                if not matches:
-                    raise HabitatException(f"Invalid expression {expr}")
-                key, value = tuple(s.encode('ascii', 'ignore').decode() for s in matches.groups())
-                storage.set(key, value)
+            storage.set_many(parse_config_expression(options.configs))
             return
 
         inputs = {}
@@ -62,5 +82,4 @@ class Setup(Command):
             if 'choices' in config and inputs[config['name']] not in config['choices']:
                 raise HabitatException('Invalid input')
 
-        for key, value in inputs.items():
-            storage.set(key, value)
+        storage.set_many(inputs)
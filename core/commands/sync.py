@@ -2,13 +2,43 @@
 # Licensed under the Apache License Version 2.0 that can be found in the
 # LICENSE file in the root directory of this source tree.
 
+import argparse
+import asyncio
 import logging
 import os
+from collections import defaultdict
 
 from core.commands.command import Command
-from core.components.solution import load_solutions
-from core.settings import COMPATIBLE_CHECK, DEFAULT_CONFIG_FILE_NAME, GLOBAL_CACHE_DIR
-from core.utils import git_root_dir, ignore_paths_in_git
+from core.settings import (COMPATIBLE_CHECK, DEFAULT_CONFIG_FILE_NAME, GLOBAL_CACHE_DIR, MAX_CONCURRENCY,
+                           MAX_FETCH_CONCURRENCY)
+from core.utils import git_root_dir, ignore_paths_in_git, is_subdir
+
+
+def group_by_nesting_level(solutions):
+    """
+    Group solutions by the number of other solutions containing them, a solution nested in another one's target
+    directory must not be synced until its parent is synced, e.g. the root solution may clean its working tree.
+    Solutions sharing a target directory write the same tree, they are put into successive levels in their order.
+    """
+    levels = defaultdict(list)
+    for index, solution in enumerate(solutions):
+        target_dir = str(solution.target_dir)
+        level = 0
+        for other_index, other in enumerate(solutions):
+            other_target_dir = str(other.target_dir)
+            if other_index == index or not is_subdir(target_dir, other_target_dir):
+                continue
+            if other_target_dir != target_dir or other_index < index:
+                level += 1
+        levels[level].append(solution)
+    return [levels[level] for level in sorted(levels)]
+
+
+def _positive_int(value):
+    jobs = int(value)
+    if jobs < 1:
+        raise argparse.ArgumentTypeError(f'must be a positive integer, got {value}')
+    return jobs
 
 
 class Sync(Command):
@@ -78,7 +108,7 @@ class Sync(Command):
         },
         {
             'flags': ['--cache-dir'],
-            'help': 'Global cache directory, default is $HOME/.habitat_cache',
+            'help': 'Global cache directory, default is $HABITAT_CACHE_DIR or $HOME/.habitat_cache',
             'default': GLOBAL_CACHE_DIR
         },
         {
@@ -105,27 +135,51 @@ class Sync(Command):
             'help': 'Sync target dependencies only.',
             'action': 'store_true',
             'default': False
+        },
+        {
+            'flags': ['-j', '--jobs'],
+            'help': 'Maximum number of dependencies fetched concurrently in each dependency group, '
+                    f'default {MAX_FETCH_CONCURRENCY}',
+            'type': _positive_int,
+            'default': MAX_FETCH_CONCURRENCY
         }
     ]
 
+    async def sync_solution(self, solution, root_dir, options):
+        if options.main:
+            await solution.fetch(root_dir, options, {})
+        else:
+            await solution.fetch_deps_only(root_dir, options, {}, existing_targets={root_dir: solution})
+
+        deps_to_ignore = [] if options.disable_ignore else [
+            dep for dep in solution.list_deps() if dep.condition and dep.ignore_in_git and dep.parent
+        ]
+        # group paths by parent directory so that each exclude file is updated only once
+        paths_by_parent = defaultdict(list)
+        for dep in deps_to_ignore:
+            paths_by_parent[dep.parent.target_dir].append(dep.target_dir)
+        for parent_dir, paths in paths_by_parent.items():
+            ignore_paths_in_git(parent_dir, paths, ignore_errors=True)
+
+        tree_str = solution.get_pretty_dependency_tree()
+        logging.debug(f'Dependency tree:\n{tree_str}')
+
     async def run(self, options, *args, **kwargs):
+        # imported here so that commands without solutions don't load the dependency graph modules
+        from core.components.solution import load_solutions
+
         root_dir = os.path.abspath(options.root or git_root_dir())
         solution_file = os.path.join(root_dir, DEFAULT_CONFIG_FILE_NAME)
         solutions = load_solutions(
             root_dir, solution_file, ignore_non_existing=options.compatible, enable_version_checking=COMPATIBLE_CHECK
         )
 
-        for solution in solutions:
-            if options.main:
-                await solution.fetch(root_dir, options, {})
-            else:
-                await solution.fetch_deps_only(root_dir, options, {}, existing_targets={root_dir: solution})
+        semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
 
-            for dep in solution.list_deps():
-                if not dep.condition:
-                    continue
-                if not options.disable_ignore and dep.ignore_in_git and dep.parent:
-                    ignore_paths_in_git(dep.parent.target_dir, [dep.target_dir], ignore_errors=True)
+        async def sync_with_limit(solution):
+            async with semaphore:
+                await self.sync_solution(solution, root_dir, options)
 
-            tree_str = solution.get_pretty_dependency_tree()
-            logging.debug(f'Dependency tree:\n{tree_str}')
+        # solutions in the same nesting level do not overlap with each other, sync them concurrently
+        for level in group_by_nesting_level(solutions):
+            await asyncio.gather(*[sync_with_limit(solution) for solution in level])
@@ -2,11 +2,32 @@
 # Licensed under the Apache License Version 2.0 that can be found in the
 # LICENSE file in the root directory of this source tree.
 
+import copy
+import functools
 import os
-import shutil
 
 from core.exceptions import HabitatException
 from core.settings import GLOBAL_CACHE_DIR
+from core.utils import link_or_copy, reflink_or_copy
+
+
+@functools.lru_cache(maxsize=128)
+def _parse_file(path, mtime_ns, size, parse, args):
+    return parse(path, *args)
+
+
+def parse_file_with_cache(path, parse, *args):
+    """
+    Return the result of ``parse(path, *args)``, the result is cached by the path, mtime and size of the file so that
+    an unchanged file will not be parsed again. A deep copy is returned since callers may mutate the result.
+    """
+    st = os.stat(path)
+    return copy.deepcopy(_parse_file(os.path.abspath(path), st.st_mtime_ns, st.st_size, parse, args))
+
+
+@functools.lru_cache(maxsize=None)
+def _cache_dir_prefix(cache_dir):
+    return os.path.join(cache_dir, '')
 
 
 class CacheMixin:
@@ -17,24 +38,41 @@ class CacheMixin:
     """
     cache_dir = os.path.join(GLOBAL_CACHE_DIR, 'objects')
 
+    def _cache_path(self, key):
+        # keys are relative paths, so a plain concatenation is enough and much cheaper than os.path.join
+        if os.path.isabs(key) or '..' in key:
+            return os.path.join(self.cache_dir, key)
+        return _cache_dir_prefix(self.cache_dir) + key
+
     def get_from_cache(self, key):
         if self.cache_dir is None:
             return
-        cache_path = os.path.join(self.cache_dir, key)
+        cache_path = self._cache_path(key)
         return cache_path if os.path.exists(cache_path) else None
 
-    def put_to_cache(self, key, path=None, content: bytes = None):
+    def put_to_cache(self, key, path=None, content: bytes = None, hardlink=False):
+        """
+        put a file or content to cache, set hardlink to True only if the file at path will not be modified in place
+        afterwards, since the cache entry will share the same inode with it.
+        """
         if self.cache_dir is None:
             return
-        cache_path = os.path.join(self.cache_dir, key)
-        if not os.path.exists(cache_path):
-            d = os.path.dirname(cache_path)
-            if not os.path.isdir(d):
-                os.makedirs(d, exist_ok=True)
-            if path:
-                shutil.copy2(path, cache_path)
-            elif content:
-                with open(cache_path, 'wb') as f:
-                    f.write(content)
-            else:
-                raise HabitatException('either "path" or "content" is required')
+        cache_path = self._cache_path(key)
+        if os.path.lexists(cache_path):
+            if os.path.exists(cache_path):
+                return
+            # a dangling symlink would never be repaired and fail every later fetch, replace it
+            os.unlink(cache_path)
+        d = os.path.dirname(cache_path)
+        # isdir is a single stat while makedirs takes more syscalls even if the directory exists
+        if not os.path.isdir(d):
+            os.makedirs(d, exist_ok=True)
+        if path and hardlink:
+            link_or_copy(path, cache_path)
+        elif path:
+            reflink_or_copy(path, cache_path)
+        elif content:
+            with open(cache_path, 'wb') as f:
+                f.write(content)
+        else:
+            raise HabitatException('either "path" or "content" is required')
@@ -1,34 +1,51 @@
 import asyncio
+import functools
 import logging
-import os
+import weakref
 from urllib.parse import urlparse
 
-import asyncio_atexit
-import httpx
-
 from core.common.http_status import client_error, server_error
 from core.exceptions import HabitatException
+from core.settings import MAX_CONCURRENCY
+
+
+@functools.lru_cache(maxsize=128)
+def _parsed_url(url):
+    # clients are usually created many times with the same base url during a sync
+    return urlparse(url)
+
 
-MAX_CONCURRENCY = int(os.environ.get('HABITAT_CONCURRENCY', 50))
+# one client (and connection pool) per event loop, shared by all HttpxClient instances
+_shared_clients = weakref.WeakKeyDictionary()
+
+
+def _shared_client():
+    # httpx is slow to import and only needed by http dependencies
+    import asyncio_atexit
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    client = _shared_clients.get(loop)
+    if client is None:
+        client = _shared_clients[loop] = httpx.AsyncClient(follow_redirects=True)
+        asyncio_atexit.register(client.aclose)
+    return client
 
 
 class HttpxClient:
     def __init__(self, base_url=None, headers=None):
         self._semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
-        self._client = httpx.AsyncClient(follow_redirects=True)
-        parsed_url = urlparse(base_url)
+        self._client = _shared_client()
+        parsed_url = _parsed_url(base_url)
         self._base_url = f'{parsed_url.scheme}://{parsed_url.netloc}'
         self._headers = headers or {}
-        asyncio_atexit.register(self._client.aclose)
 
     async def async_request(self, method: str, path: str, timeout=20, extra_headers=None, **kwargs):
         suppress = kwargs.get('suppress', False)
-        url = f'{self._base_url}{"" if path.startswith("/") else "/"}{path}'
-        logging.debug(f'{self._base_url=}, {url=}')
+        url = self._url(path)
+        headers = {**self._headers, **extra_headers} if extra_headers else self._headers
         async with self._semaphore:
-            resp = await self._client.request(
-                method, url, headers={**self._headers, **(extra_headers or {})}, timeout=timeout
-            )
+            resp = await self._client.request(method, url, headers=headers, timeout=timeout)
             if server_error(resp.status_code) or client_error(resp.status_code):
                 if not suppress:
                     raise HabitatException(f'request got a status code {resp.status_code}')
@@ -36,3 +53,27 @@ class HttpxClient:
                     return resp, resp.headers, None
 
             return resp, resp.headers, resp.content
+
+    async def async_stream(self, path: str, write, timeout=20, extra_headers=None):
+        """
+        send a GET request and pass the body to write block by block instead of loading it into memory.
+        write may be a coroutine function, which is awaited for every block.
+        """
+        url = self._url(path)
+        headers = {**self._headers, **extra_headers} if extra_headers else self._headers
+        is_async = asyncio.iscoroutinefunction(write)
+        async with self._semaphore:
+            async with self._client.stream('GET', url, headers=headers, timeout=timeout) as resp:
+                if server_error(resp.status_code) or client_error(resp.status_code):
+                    raise HabitatException(f'request got a status code {resp.status_code}')
+                async for block in resp.aiter_bytes():
+                    if is_async:
+                        await write(block)
+                    else:
+                        write(block)
+            return resp
+
+    def _url(self, path):
+        url = f'{self._base_url}{"" if path.startswith("/") else "/"}{path}'
+        logging.debug(f'{self._base_url=}, {url=}')
+        return url
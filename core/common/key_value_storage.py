@@ -4,6 +4,7 @@
 
 import json
 import os
+import tempfile
 
 
 class NotSet:
@@ -21,10 +22,30 @@ class KeyValueStorage:
         except FileNotFoundError:
             pass
 
+    def _dump(self):
+        # write to a temporary file in the same directory then replace the original one,
+        # so that the storage file will never be left half-written.
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.file_path))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.data, f)
+            os.replace(temp_path, self.file_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
     def set(self, key, value):
+        if key in self.data and self.data[key] == value:
+            return
         self.data[key] = value
-        with open(self.file_path, 'w') as f:
-            json.dump(self.data, f)
+        self._dump()
+
+    def set_many(self, items: dict):
+        changed = {k: v for k, v in items.items() if k not in self.data or self.data[k] != v}
+        if not changed:
+            return
+        self.data.update(changed)
+        self._dump()
 
     def get(self, key):
         return self.data.get(key, NotSet)
@@ -32,5 +53,4 @@ class KeyValueStorage:
     def delete(self, key):
         if key in self.data:
             del self.data[key]
-            with open(self.file_path, 'w') as f:
-                json.dump(self.data, f)
+            self._dump()
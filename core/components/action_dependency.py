@@ -2,6 +2,7 @@
 # Licensed under the Apache License Version 2.0 that can be found in the
 # LICENSE file in the root directory of this source tree.
 
+import inspect
 import logging
 import os
 import subprocess
@@ -12,6 +13,27 @@ from core.exceptions import HabitatException
 from core.utils import async_check_output
 
 
+def call_function(function, cwd):
+    """
+    Call the function of an action. The working directory is process-wide and shared by all dependencies fetched
+    concurrently, so functions with an explicit "cwd" parameter get the directory passed in, all other functions,
+    including ones taking only **kwargs, are called with the working directory changed temporarily.
+    """
+    try:
+        parameter = inspect.signature(function).parameters.get('cwd')
+    except (TypeError, ValueError):
+        parameter = None
+    if parameter is not None and parameter.kind in (parameter.POSITIONAL_OR_KEYWORD, parameter.KEYWORD_ONLY):
+        return function(cwd=cwd)
+
+    saved_dir = os.getcwd()
+    os.chdir(cwd)
+    try:
+        return function()
+    finally:
+        os.chdir(saved_dir)
+
+
 class ActionDependency(Component):
     type = 'action'
     defined_fields = {
@@ -38,21 +60,20 @@ class ActionDependency(Component):
         logging.info(f'Run action {self.name}')
         commands = self.commands
         env = getattr(self, 'env', {})
+        # commands inherit the environment of habitat if there is no extra environment variable
+        env = {**os.environ, **env} if env else None
         cwd = getattr(self, 'cwd', None)
         cwd = os.path.join(root_dir, cwd) if cwd else root_dir
 
-        if self.function:
-            saved_dir = os.getcwd()
-            os.chdir(cwd)
-            self.function()
-            os.chdir(saved_dir)
-
         try:
+            if self.function:
+                call_function(self.function, cwd)
+
             for command in commands:
                 logging.info(f'Run command {command} in path {cwd}')
                 await async_check_output(
                     command,
-                    shell=isinstance(command, str), stderr=subprocess.STDOUT, cwd=cwd, env={**os.environ.copy(), **env}
+                    shell=isinstance(command, str), stderr=subprocess.STDOUT, cwd=cwd, env=env
                 )
             self.on_fetched(root_dir, options)
         except subprocess.CalledProcessError as e:
@@ -4,12 +4,20 @@
 
 import logging
 from abc import ABC
+from collections import deque
 from pathlib import Path
-from typing import Any
 
 from core.exceptions import HabitatException
 from core.fetchers.dummy_fetcher import DummyFetcher
 
+# fields that are read many times while scheduling fetches, they are stored as instance attributes as well so that
+# reading them doesn't go through __getattr__
+HOT_FIELDS = (
+    'name', 'target_dir', 'parent', 'condition', 'require', 'disable_link', 'url', 'branch', 'commit', 'tag', 'paths',
+    'ignore_in_git', 'fetch_mode'
+)
+_MISSING = object()
+
 
 class Component(ABC):
     type = None
@@ -35,13 +43,39 @@ class Component(ABC):
         }
     }
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # the schema of a component class is static, flatten it once per class rather than once per instance
+        cls._fields = tuple(
+            (
+                name,
+                field_attr.get('optional', False),
+                field_attr.get('default', _MISSING),
+                field_attr.get('type'),
+                field_attr.get('validator')
+            )
+            for name, field_attr in {**cls._defined_fields, **cls.defined_fields}.items()
+        )
+        # defaults of absent fields are shared by all instances as class attributes instead of being set on each one
+        cls._field_defaults = {
+            name: default for name, optional, default, _, _ in cls._fields if not optional and default is not _MISSING
+        }
+        for name, default in cls._field_defaults.items():
+            setattr(cls, name, default)
+        # configured values must be stored on the instance as well, otherwise the class defaults would shadow them
+        cls._instance_fields = tuple(dict.fromkeys(HOT_FIELDS + tuple(cls._field_defaults)))
+
     def __init__(self, target_dir: Path, config_dict: dict, parent: 'Component' = None, entries=None):
+        self._source = None
+        self._source_stamp = None
         self._attr_dict = {
             'target_dir': target_dir,
             'parent': parent,
             'global_entries': entries,
             **config_dict
         }
+        vars(self).update({k: self._attr_dict[k] for k in self._instance_fields if k in self._attr_dict})
+        self._root = self if parent is None else parent._root
         self.fetcher = DummyFetcher(self)
         self.fetched = False
         self.fetched_paths = []
@@ -55,6 +89,11 @@ class Component(ABC):
         except KeyError:
             raise AttributeError(f'attribute {item} not found')
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if self._is_source_attribute(name):
+            self._reset_source_cache()
+
     def __str__(self):
         return f'{self.name}(target_dir: {self.target_dir} fetched:{self.fetched})'
 
@@ -68,43 +107,52 @@ class Component(ABC):
 
     @property
     def source(self):
-        return ":".join(getattr(self, a) for a in self.source_attributes)
+        if self._source is None:
+            self._source = ":".join(getattr(self, a) for a in self.source_attributes)
+        return self._source
 
     @property
     def source_stamp(self):
-        return self.source + "@" + "+".join([
-            getattr(self, a, "") for a in self.source_stamp_attributes if hasattr(self, a) and getattr(self, a)
-        ])
+        if self._source_stamp is None:
+            values = (getattr(self, a, None) for a in self.source_stamp_attributes)
+            self._source_stamp = self.source + "@" + "+".join(v for v in values if v)
+        return self._source_stamp
+
+    def _is_source_attribute(self, name):
+        return name in (self.source_attributes or ()) or name in (self.source_stamp_attributes or ())
+
+    def _reset_source_cache(self):
+        # source and source_stamp are memoized, they must be recomputed once one of their attributes changes
+        self._source = None
+        self._source_stamp = None
 
     def set_attr(self, name, value, override=False):
         if name in self._attr_dict and not override:
             raise HabitatException(f'attribute {name} exists')
         self._attr_dict[name] = value
+        if name in vars(self) or name in self._field_defaults:
+            vars(self)[name] = value
+        if self._is_source_attribute(name):
+            self._reset_source_cache()
 
     def list_deps(self):
-        root = self
-        while not root.is_root:
-            root = root.parent
-
-        components = [root]
+        components = deque([self._root])
         while components:
-            p = components.pop(0)
+            p = components.popleft()
             children = getattr(p, 'children', [])
             yield p
             for c in children:
                 components.append(c)
 
     def get_pretty_dependency_tree(self):
-        root = self
-        while not root.is_root:
-            root = root.parent
-
-        components = [root]
+        root = self._root
+        components = deque([root])
         tree_str = root.name
         indent = ""
         while components:
-            p = components.pop(0)
+            p = components.popleft()
             children = getattr(p, 'children', [])
+            # NOTE: the indent grows with every visited component rather than with every level of the tree
             indent += "   "
             for c in children:
                 tree_str += f"\n{indent}└──{c.name}"
@@ -112,27 +160,32 @@ class Component(ABC):
         return tree_str
 
     def check_and_populate_config(self):
-        fields = {**self._defined_fields, **self.defined_fields}
-        for name, field_attr in fields.items():
-            optional = field_attr.get('optional', False)
-            if not optional and not hasattr(self, name) and 'default' not in field_attr:
-                raise HabitatException(f'field {name} is required for {self} but not exist.')
+        for name, optional, default, _type, validator in self._fields:
+            value = self._attr_dict.get(name, _MISSING)
+            missing = value is _MISSING
+            if missing:
+                if not optional and default is _MISSING:
+                    raise HabitatException(f'field {name} is required for {self} but not exist.')
+                value = None
 
-            value = getattr(self, name, None)
             if value is None and not optional:
-                default_value = field_attr['type']() if 'type' in field_attr else None
-                value = field_attr.get('default', default_value)
-                setattr(self, name, value)
-
-            if value and 'validator' in field_attr and not field_attr['validator'](value, self):
+                if default is not _MISSING:
+                    value = default
+                else:
+                    value = _type() if _type else None
+                # an absent field reads its default from the class attribute
+                if not missing:
+                    setattr(self, name, value)
+
+            if value and validator and not validator(value, self):
                 raise HabitatException(f'invalid value {value} for field {name} in {self}')
 
-            _type: Any = field_attr.get('type')
-            if _type and not optional and not isinstance(getattr(self, name), _type):
+            if _type and not optional and not isinstance(value, _type):
                 raise HabitatException(f'field {name} require a {_type}, but got a {type(value)}')
 
     def set_parent(self, parent: 'Component'):
         setattr(self, 'parent', parent)
+        self._root = self if parent is None or parent is self else parent._root
 
     def on_fetched(self, root_dir, options):
         self.fetched = True
@@ -141,21 +194,23 @@ class Component(ABC):
         return self.local_source_stamps.get(self.name) == self.source_stamp
 
     async def fetch(self, root_dir, options, existing_sources=None, existing_targets=None):
-        logging.info(f'Sync dependency {self.name}')
+        # lazy %-style formatting, this runs for every dependency including up to date ones
+        logging.info('Sync dependency %s', self.name)
         try:
             if options.force or not self.up_to_date():
                 self.fetched_paths = await self.fetcher.fetch(root_dir, options)
             else:
                 logging.debug(
-                    f'local source stamp cache cache of {self.name} is synchronized with source stamp, '
-                    f'skip fetching'
+                    'local source stamp cache cache of %s is synchronized with source stamp, skip fetching', self.name
                 )
             self.on_fetched(root_dir, options)
         except Exception as e:
             raise HabitatException(f'failed to fetch dependency {self.source_stamp} to {self.target_dir}') from e
         finally:
-            if hasattr(self, 'parent') and self.parent:
-                self.parent.produce_event(self.name)
+            # requirements are produced even if nothing was fetched, dependents are waiting on them
+            parent = self.parent
+            if parent:
+                parent.produce_event(self.name)
 
     def __repr__(self):
         return str(self._attr_dict)
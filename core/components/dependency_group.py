@@ -6,6 +6,7 @@ import asyncio
 import logging
 import os
 from abc import ABC
+from collections import defaultdict
 from pathlib import Path
 
 from core.components.component import Component
@@ -16,36 +17,49 @@ from core.settings import MAX_DEPENDENCY_WAIT_TIME
 from core.utils import cycle_detection
 
 
-async def fetch_child(child, *args, events=None, **kwargs):
-    logging.debug(
-        f'fetch child {child.name} parent: {child.parent} children: {getattr(child, "children", [])}'
-    )
-    for e in events or []:
-        logging.debug(f'Waiting on event {e}')
+async def fetch_child(child, *args, events=None, semaphore=None, **kwargs):
+    logging.debug('fetch child %s parent: %s children: %s', child.name, child.parent, getattr(child, 'children', []))
+    if events:
+        logging.debug('Waiting on events %s', events)
         try:
-            await asyncio.wait_for(e.wait(), MAX_DEPENDENCY_WAIT_TIME)
+            # a single timer for all the requirements
+            await asyncio.wait_for(asyncio.gather(*(e.wait() for e in events)), MAX_DEPENDENCY_WAIT_TIME)
         except asyncio.TimeoutError:
+            pending = ', '.join(str(e) for e in events if not e.is_set())
             raise HabitatException(
                 f'Timeout of {MAX_DEPENDENCY_WAIT_TIME} '
-                f'seconds expired when waiting on event {e} for {child.name}.'
+                f'seconds expired when waiting on event {pending} for {child.name}.'
             )
-        logging.debug(f'Got event {e}')
-    await child.fetch(*args, **kwargs)
+        logging.debug('Got events %s', events)
+    if semaphore is None:
+        await child.fetch(*args, **kwargs)
+        return
+    # acquired after the requirements are fetched so that waiting children don't hold a slot
+    async with semaphore:
+        await child.fetch(*args, **kwargs)
 
 
 def get_final_components_to_fetch(components_to_fetch):
-    has_new_skipped_component = False
-    logging.debug(f"Before filter: components => {components_to_fetch.keys()}")
-    for name in list(components_to_fetch.keys()):
-        require = getattr(components_to_fetch[name], 'require', [])
-        if set(require) - set(components_to_fetch.keys()):
-            has_new_skipped_component = True
-            logging.warning(f'Skip component {name} due to the fact that some requirements were skipped')
-            components_to_fetch.pop(name, None)
-
-    logging.debug(f"After filter: components => {components_to_fetch.keys()}")
-    if has_new_skipped_component:
-        get_final_components_to_fetch(components_to_fetch)
+    logging.debug("Before filter: components => %s", components_to_fetch.keys())
+    dependents = defaultdict(list)
+    skipped = []
+    for name, component in components_to_fetch.items():
+        require = getattr(component, 'require', [])
+        for r in require:
+            dependents[r].append(name)
+        if any(r not in components_to_fetch for r in require):
+            skipped.append(name)
+
+    # skipping a component makes the components requiring it unsatisfiable as well
+    while skipped:
+        name = skipped.pop()
+        if name not in components_to_fetch:
+            continue
+        logging.warning('Skip component %s due to the fact that some requirements were skipped', name)
+        components_to_fetch.pop(name)
+        skipped.extend(dependents[name])
+
+    logging.debug("After filter: components => %s", components_to_fetch.keys())
 
 
 class DependencyGroup(Component, ABC):
@@ -80,17 +94,23 @@ class DependencyGroup(Component, ABC):
         existing_sources = existing_sources or {}
         existing_targets = existing_targets or {}
         components_to_fetch = {}
+        target_normpaths = {}
         for child in self._children:
+            name = child.name
             if not child.condition:
-                logging.info(f'skip dependency {child.name} due to unsatisfied condition')
+                logging.info('skip dependency %s due to unsatisfied condition', name)
                 continue
 
+            source = child.source
+            target_normpath = target_normpaths[name] = os.path.normpath(child.target_dir)
+
             # check if dependencies conflict
-            source_item = existing_sources.get(child.source)
+            source_item = existing_sources.get(source)
             if source_item:
-                if source_item.source_stamp != child.source_stamp:
+                source_stamp = child.source_stamp
+                if source_item.source_stamp != source_stamp:
                     message = f'source stamps conflict:\n  {source_item.source_stamp} ({source_item.target_dir})' \
-                              f' vs {child.source_stamp} ({child.target_dir})'
+                              f' vs {source_stamp} ({child.target_dir})'
                     if options.strict:
                         # In strict mode, conflicts of source stamp conflicts are allowed
                         raise HabitatException(message)
@@ -99,18 +119,19 @@ class DependencyGroup(Component, ABC):
                 if set(getattr(source_item, 'paths', [])) == set(getattr(child, 'paths', [])):
                     # We can simply create a symbolic if two packages have the same paths sources
                     child.fetcher = LocalFetcher(child, source_item, symlink=not child.disable_link)
-                    components_to_fetch[child.name] = child
+                    components_to_fetch[name] = child
                     continue
 
             # Same targets but different sources
-            target_normpath = os.path.normpath(child.target_dir)
             target_item = existing_targets.get(target_normpath)
             if target_item:
-                if target_item.source != child.source:
-                    logging.warning(f'Skip fetching {child.source} to {child.target_dir} '
-                                    f'because another source {target_item.source} exists in the same directory')
+                if target_item.source != source:
+                    logging.warning(
+                        'Skip fetching %s to %s because another source %s exists in the same directory',
+                        source, child.target_dir, target_item.source
+                    )
                 continue
-            components_to_fetch[child.name] = child
+            components_to_fetch[name] = child
 
         # Filter out components whose require has been skipped recursively
         get_final_components_to_fetch(components_to_fetch)
@@ -118,24 +139,25 @@ class DependencyGroup(Component, ABC):
         # cycle detection
         cycle_detection(components_to_fetch)
 
+        register_consumer = self._event_manager.register_consumer
+        semaphore = asyncio.Semaphore(options.jobs)
         for name, child in components_to_fetch.items():
-            require = getattr(child, 'require', [])
-            events = []
+            events = [register_consumer(r) for r in getattr(child, 'require', [])]
 
-            for r in require:
-                events.append(self._event_manager.register_consumer(r))
-
-            f = fetch_child(child, root_dir, options, existing_sources, existing_targets, events=events)
-            futures.append(f)
-            target_normpath = os.path.normpath(child.target_dir)
-            existing_targets[target_normpath] = child
-            if not existing_sources.get(child.source):
-                existing_sources[child.source] = child
+            f = fetch_child(
+                child, root_dir, options, existing_sources, existing_targets, events=events, semaphore=semaphore
+            )
+            futures.append(asyncio.ensure_future(f))
+            existing_targets[target_normpaths[name]] = child
+            existing_sources.setdefault(child.source, child)
 
         try:
             await asyncio.gather(*futures)
         except BaseException as e:
             self._event_manager.clear()
+            # don't keep fetching siblings of a failed child
+            for f in futures:
+                f.cancel()
             raise e
 
     def on_children_fetched(self, root_dir, options):
@@ -2,60 +2,90 @@
 # Licensed under the Apache License Version 2.0 that can be found in the
 # LICENSE file in the root directory of this source tree.
 
-import hashlib
+import functools
 import json
 import logging
 import os
+import re
 import subprocess
 import sys
 from pathlib import Path
 
 from core import __version__, components
+from core.common.cache_mixin import parse_file_with_cache
 from core.common.error_code import ERROR_INCOMPATIBLE_VERSION
 from core.components.dependency_group import DependencyGroup
 from core.exceptions import HabitatException
 from core.fetchers.git_fetcher import GitFetcher
-from core.settings import DEFAULT_CONFIG_FILE_NAME, DEFAULT_DEPS_CACHE_FILE_NAME, ENTRIES_CACHE_TAG_PREFIX
-from core.utils import check_call, eval_deps, find_classes, get_head_commit_id, is_git_sha
+from core.settings import DEFAULT_CONFIG_FILE_NAME, ENTRIES_CACHE_TAG_PREFIX
+from core.utils import check_call, code_references, eval_deps, find_classes, get_head_commit_id, is_git_sha, load_code
 
+SOLUTIONS_JSON_RE = re.compile(r'^solutions\s*=\s*(\[.*\])\s*$', re.DOTALL)
+# names through which a deps file can read the target it is evaluated for
+TARGET_DEPENDENT_NAMES = frozenset(['target', 'globals', 'locals', 'vars', 'eval', 'exec'])
 
-def store_entries_cache_to_git(entries_cache: dict, root_dir=None):
-    root_dir = root_dir or os.getcwd()
-    head_commit_id = get_head_commit_id(cwd=root_dir)
-    temp_file = os.path.join(root_dir, f'{DEFAULT_DEPS_CACHE_FILE_NAME}_{head_commit_id}')
-    with open(temp_file, 'w') as f:
-        logging.debug(f'writing deps cache: {entries_cache}')
-        json.dump(entries_cache, f)
 
-    sha = subprocess.check_output(['git', 'hash-object', '-w', temp_file], cwd=root_dir).decode().strip()
+def store_entries_cache_to_git(entries_cache: dict, root_dir=None, head_commit_id=None):
+    root_dir = root_dir or os.getcwd()
+    head_commit_id = head_commit_id or get_head_commit_id(cwd=root_dir)
+    logging.debug('writing deps cache: %s', entries_cache)
+    # keys are sorted so that the same entries always produce the same git object
+    content = json.dumps(entries_cache, sort_keys=True, separators=(',', ':')).encode()
+    sha = subprocess.check_output(
+        ['git', '--no-optional-locks', 'hash-object', '-w', '--stdin'], input=content, cwd=root_dir
+    ).decode().strip()
     check_call(['git', 'tag', '-f', f'{ENTRIES_CACHE_TAG_PREFIX}_{head_commit_id}', sha], cwd=root_dir)
-    os.remove(temp_file)
 
 
-def load_entries_cache_from_git(root_dir=None):
-    try:
-        deps_cache = subprocess.check_output(
-            ['git', 'cat-file', '-p', f'{ENTRIES_CACHE_TAG_PREFIX}_{get_head_commit_id(cwd=root_dir)}'],
+@functools.lru_cache(maxsize=None)
+def dependency_classes_by_type():
+    # component classes are all defined in core.components, so they only need to be discovered once
+    dependency_classes = find_classes(components, lambda c: getattr(c, 'is_component', False))
+    return {c.type: c for c in dependency_classes if c.type}
+
 
+def load_entries_cache_from_git(root_dir=None, head_commit_id=None):
+    head_commit_id = head_commit_id or get_head_commit_id(cwd=root_dir)
+    try:
+        content = subprocess.check_output(
+            ['git', '--no-optional-locks', 'cat-file', '-p', f'{ENTRIES_CACHE_TAG_PREFIX}_{head_commit_id}'],
             cwd=root_dir or os.getcwd(), stderr=subprocess.DEVNULL
-        ).decode().strip()
-        deps_cache = json.loads(deps_cache)
-        return deps_cache
-    except subprocess.CalledProcessError:
+        )
+        return json.loads(content)
+    except (subprocess.CalledProcessError, ValueError):
+        # ValueError covers both invalid json and invalid utf-8
         return None
 
 
-def load_solutions(root_dir, solution_file, ignore_non_existing=False, enable_version_checking=True):
+def eval_solutions(solution_file):
+    if hasattr(solution_file, 'read'):
+        content = solution_file.read()
+    else:
+        with open(solution_file, 'r') as f:
+            content = f.read()
+
+    # configuration files generated by "hab config" only assign a JSON document to solutions, load them without exec
+    matches = SOLUTIONS_JSON_RE.match(content)
+    if matches:
+        try:
+            return {'solutions': json.loads(matches.group(1))}
+        except json.JSONDecodeError:
+            pass
+
     env = {}
+    exec(content, env)
+    return {k: env[k] for k in ('habitat_version', 'solutions') if k in env}
+
+
+def load_solutions(root_dir, solution_file, ignore_non_existing=False, enable_version_checking=True):
     if hasattr(solution_file, 'read'):
-        exec(solution_file.read(), env)
+        env = eval_solutions(solution_file)
     else:
         if not os.path.exists(solution_file):
             if ignore_non_existing:
                 return []
             raise HabitatException(f'File {DEFAULT_CONFIG_FILE_NAME} not found in directory {root_dir}')
-        with open(solution_file, 'r') as f:
-            exec(f.read(), env)
+        env = parse_file_with_cache(solution_file, eval_solutions)
 
     if 'habitat_version' in env and env['habitat_version'] != __version__.__version__:
         logging.warning(
@@ -83,8 +113,7 @@ def load_mapping_file(mapping_file_path):
     env = {}
     if not os.path.exists(mapping_file_path):
         return None
-    with open(mapping_file_path, 'r') as f:
-        exec(f.read(), env)
+    exec(load_code(mapping_file_path), env)
 
     return env.get('mappings')
 
@@ -94,16 +123,13 @@ def apply_mapping(dep, mappings: dict):
         original_attr = getattr(dep, attr)
         if original_attr in mp:
             dep.set_attr(attr, mp[original_attr], override=True)
-            logging.info(f"replace ({dep.name})'s [{attr}] {original_attr} with {mp[original_attr]}")
+            logging.info("replace (%s)'s [%s] %s with %s", dep.name, attr, original_attr, mp[original_attr])
 
 
 def merge_dict(base, new):
-    merged_dict = {}
-    for key in set(base.keys()) | set(new.keys()):
-        if key == 'condition':
-            merged_dict[key] = base.get(key) or new.get(key)
-        else:
-            merged_dict[key] = base.get(key) if key not in new else new[key]
+    merged_dict = {**base, **new}
+    if 'condition' in merged_dict:
+        merged_dict['condition'] = base.get('condition') or new.get('condition')
     return merged_dict
 
 
@@ -113,12 +139,11 @@ def merge_deps(base, new):
     if not new:
         return base
 
-    merged_deps = {}
-    for key in set(base.keys()) | set(new.keys()):
-        if base.get(key) and new.get(key):
-            merged_deps[key] = merge_dict(base[key], new[key])
-        else:
-            merged_deps[key] = base.get(key) if key not in new else new[key]
+    merged_deps = {**base, **new}
+    for key, value in new.items():
+        base_value = base.get(key)
+        if base_value and value:
+            merged_deps[key] = merge_dict(base_value, value)
     return merged_deps
 
 
@@ -194,26 +219,20 @@ class Solution(DependencyGroup):
         else:
             _mappings = load_mapping_file(mapping_file_abs_path)
 
-        dependency_classes = find_classes(
-            components, lambda c: getattr(c, 'is_component', False)
-        )
+        classes_by_type = dependency_classes_by_type()
         for name, config in deps.items():
             if 'type' not in config:
                 raise HabitatException(f'dependency must has a type, got config {config}')
             dep_type = config.get('type')
-            try:
-                dep = next(
-                    c for c in dependency_classes if c.type == dep_type
-                )(Path(self.target_dir) / Path(name), {'name': name, **config}, self)
-
-                if _mappings:
-                    apply_mapping(dep, _mappings)
-
-            except StopIteration:
+            dependency_class = classes_by_type.get(dep_type)
+            if dependency_class is None:
                 raise HabitatException(f'invalid dependency type {dep_type} in config {config}')
-            else:
-                dep.set_attr('local_source_stamps', self.local_source_stamps, override=True)
-                self.add_child(dep)
+
+            dep = dependency_class(Path(self.target_dir) / Path(name), {'name': name, **config}, self)
+            if _mappings:
+                apply_mapping(dep, _mappings)
+            dep.set_attr('local_source_stamps', self.local_source_stamps, override=True)
+            self.add_child(dep)
 
     def load_deps(self, root_dir, targets=None, target_only=False):
         targets = targets or []
@@ -222,10 +241,12 @@ class Solution(DependencyGroup):
             logging.warning(f'deps file {deps_file_path} not found, skip sync deps')
             return
 
-        deps_cache = load_entries_cache_from_git(root_dir) or {}
-        # check hash
-        md5_hash = hashlib.md5(repr(deps_cache.get('entries', '')).encode()).hexdigest()
-        if md5_hash != deps_cache.get('hash'):
+        # nothing between loading and storing the cache changes HEAD, so it is resolved only once
+        head_commit_id = get_head_commit_id(cwd=root_dir)
+        deps_cache = load_entries_cache_from_git(root_dir, head_commit_id) or {}
+        cached_entries = deps_cache.get('entries')
+        # the cache is read from a git object which is already integrity checked by git, only check its structure
+        if not isinstance(deps_cache.get('entries'), dict):
             logging.debug('deps cache is broken, try a complete synchronization')
             logging.debug(f'deps cache: {deps_cache}')
             self.set_attr('local_source_stamps', {}, override=True)
@@ -235,11 +256,18 @@ class Solution(DependencyGroup):
         deps = {}
         # if target is specified and --target-only is set, skip base deps.
         skip_base_deps = target_only and not targets == [None]
+        # a deps file that doesn't read the target evaluates to the same deps for every target, so it is evaluated with
+        # a fixed target and the parsed result is reused for the other targets
+        target_dependent = code_references(load_code(deps_file_path), TARGET_DEPENDENT_NAMES)
         for target in targets:
-            deps = merge_deps(deps, eval_deps(deps_file_path, target, root_dir)) if not skip_base_deps else {}
+            if not skip_base_deps:
+                deps_target = target if target_dependent else None
+                deps = merge_deps(deps, parse_file_with_cache(deps_file_path, eval_deps, deps_target, root_dir))
+            else:
+                deps = {}
             if hasattr(self, 'target_deps_files') and target and self.target_deps_files.get(target):
                 target_deps_file = os.path.join(self.target_dir, self.target_deps_files.get(target, 'DEPS.' + target))
-                deps = merge_deps(deps, eval_deps(target_deps_file, target, root_dir))
+                deps = merge_deps(deps, parse_file_with_cache(target_deps_file, eval_deps, target, root_dir))
 
         mappings = load_mapping_file(os.path.join(root_dir, DEFAULT_CONFIG_FILE_NAME))
         self.instantiate_deps(root_dir, deps, mappings)
@@ -251,8 +279,12 @@ class Solution(DependencyGroup):
             deps_cache["entries"][dep.name] = dep.source_stamp
 
         # update entries cache
-        deps_cache["hash"] = hashlib.md5(repr(deps_cache["entries"]).encode()).hexdigest()
-        store_entries_cache_to_git(deps_cache, root_dir=root_dir)
+        # the hash written by older versions is not needed anymore, drop it when the cache is rewritten
+        legacy_hash = deps_cache.pop('hash', None)
+        if deps_cache['entries'] == cached_entries and legacy_hash is None:
+            logging.debug('deps cache is unchanged, skip updating it')
+            return
+        store_entries_cache_to_git(deps_cache, root_dir=root_dir, head_commit_id=head_commit_id)
 
     def up_to_date(self):
         return is_git_sha(getattr(self, 'commit', '')) and super().up_to_date()
@@ -7,11 +7,13 @@ import os
 from core.common.key_value_storage import KeyValueStorage, NotSet
 from core.exceptions import HabitatException
 
+ENV_PREFIX = 'HABITAT_'
+
 
 class ConfigStorage(KeyValueStorage):
 
     def get(self, key, default=None):
-        value = os.environ.get('HABITAT_' + key.upper().replace('.', '_')) or \
+        value = os.environ.get(ENV_PREFIX + key.upper().replace('.', '_')) or \
             default or \
             super(ConfigStorage, self).get(key) or \
             NotSet
@@ -22,9 +24,11 @@ class ConfigStorage(KeyValueStorage):
         return value
 
     def __iter__(self):
-        config = self.data
         # read all environment variables that start with "HABITAT_". configurations in ~/.habitat_cache/meta/config
         # will be overridden by environment variables.
-        config.update({k.lower().replace('_', '.').replace('habitat.', ''): v for k, v in os.environ.items() if
-                       k.startswith("HABITAT_")})
-        return iter(config.items())
+        env_config = {
+            k[len(ENV_PREFIX):].lower().replace('_', '.'): v for k, v in os.environ.items() if k.startswith(ENV_PREFIX)
+        }
+        for key, value in self.data.items():
+            yield key, env_config.pop(key, value)
+        yield from env_config.items()
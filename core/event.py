@@ -13,3 +13,5 @@ class Event(asyncio.Event):
 
     def __str__(self):
         return "event: " + self._name
+
+    __repr__ = __str__
@@ -3,6 +3,7 @@
 # LICENSE file in the root directory of this source tree.
 
 import logging
+from collections import defaultdict
 
 from core.event import Event
 
@@ -10,7 +11,8 @@ from core.event import Event
 class ThreadingEventManager:
 
     def __init__(self):
-        self._event_consumers = {}
+        self._event_consumers = defaultdict(list)
+        self._produced_events = set()
 
     def clear(self):
         for k, event_list in self._event_consumers.items():
@@ -20,18 +22,22 @@ class ThreadingEventManager:
 
     def register_consumer(self, event_name) -> Event:
         assert isinstance(event_name, str), 'event_name can only be str'
-        logging.debug(f'register consumer for event {event_name}')
+        logging.debug('register consumer for event %s', event_name)
         event = Event(event_name)
-        event_list = self._event_consumers.get(event_name, [])
-        event_list.append(event)
-        self._event_consumers[event_name] = event_list
+        if event_name in self._produced_events:
+            # the event was produced before this consumer registered, don't wait for it again
+            event.set()
+        else:
+            self._event_consumers[event_name].append(event)
         return event
 
     def produce_event(self, event_name):
-        logging.debug(f'produce event {event_name}')
-        if event_name not in self._event_consumers:
-            logging.debug(f'no consumers found for event: {event_name}')
+        logging.debug('produce event %s', event_name)
+        self._produced_events.add(event_name)
+        event_list = self._event_consumers.get(event_name)
+        if event_list is None:
+            logging.debug('no consumers found for event: %s', event_name)
             return
-        for event in self._event_consumers[event_name]:
+        for event in event_list:
             event.set()
-        self._event_consumers[event_name].clear()
+        event_list.clear()
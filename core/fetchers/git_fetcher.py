@@ -2,57 +2,117 @@
 # Licensed under the Apache License Version 2.0 that can be found in the
 # LICENSE file in the root directory of this source tree.
 
+import asyncio
 import hashlib
 import logging
 import os
 import re
 import subprocess
 import sys
-from glob import glob
+import weakref
+from glob import glob, has_magic
 
 from core.exceptions import HabitatException
 from core.fetchers.fetcher import Fetcher
-from core.settings import DEBUG
+from core.settings import DEBUG, GIT_CACHE_FILTER
 from core.utils import (async_check_output, convert_git_url_to_http, create_temp_dir, get_full_commit_id,
-                        is_bare_git_repo, is_git_repo_valid, is_git_root, is_git_user_set, move, rmtree,
-                        set_git_alternates)
+                        is_bare_git_repo, is_git_repo_valid, is_git_root, is_git_sha, is_git_user_set, move, rmtree,
+                        set_git_alternates, to_thread)
+
+ALL_BRANCHES_REF_SPEC = '+refs/heads/*:refs/remotes/origin/*'
+
+_HEAD_BRANCH_RE = re.compile(r'HEAD branch: (\S+)')
+
+# deps sharing a url share a cache directory, which must not be initialized or fetched into concurrently
+_cache_locks = weakref.WeakKeyDictionary()
+
+
+def _cache_lock(repo_cache_dir):
+    locks = _cache_locks.setdefault(asyncio.get_running_loop(), {})
+    lock = locks.get(repo_cache_dir)
+    if lock is None:
+        lock = locks[repo_cache_dir] = asyncio.Lock()
+    return lock
+
+
+def _cache_ref(ref_spec):
+    if is_git_sha(ref_spec):
+        return f'refs/habitat/commits/{ref_spec}'
+    return ref_spec.rsplit()[-1]
+
+
+def _has_ref(git_dir, ref):
+    """
+    look a ref up in the loose and packed refs of a repository using the files backend, without spawning git.
+    """
+    if not ref.startswith('refs/'):
+        return False
+    if os.path.isfile(os.path.join(git_dir, ref)):
+        return True
+    try:
+        with open(os.path.join(git_dir, 'packed-refs')) as f:
+            # lines are "<sha> <ref>", besides the header and "^<sha>" lines of peeled tags
+            return any(line.rstrip('\n').split(' ', 1)[-1] == ref for line in f if line[0] not in '#^')
+    except FileNotFoundError:
+        return False
 
 
 async def fetch_in_cache_if_needed(
     url, ref_spec, global_cache_dir, fetch_all=False
 ):
-    repo_name = re.split(r'/|:', url)[-1]
-    repo_cache_dir = os.path.join(global_cache_dir, repo_name, hashlib.md5(url.encode()).hexdigest())
+    # the last component of the url, which is separated by ':' in scp-like urls
+    repo_name = url.replace(':', '/').rsplit('/', 1)[-1]
+    repo_cache_dir = os.path.join(global_cache_dir, repo_name, hashlib.blake2b(url.encode(), digest_size=8).hexdigest())
+    if not os.path.exists(repo_cache_dir):
+        # caches created by older versions are keyed by the md5 of the url, they are kept in place since the
+        # alternates of existing repositories point into them
+        legacy_repo_cache_dir = os.path.join(global_cache_dir, repo_name, hashlib.md5(url.encode()).hexdigest())
+        if os.path.isdir(legacy_repo_cache_dir):
+            repo_cache_dir = legacy_repo_cache_dir
+    async with _cache_lock(repo_cache_dir):
+        await _fetch_in_cache(url, ref_spec, repo_cache_dir, fetch_all)
+    return repo_cache_dir
+
+
+async def _fetch_in_cache(url, ref_spec, repo_cache_dir, fetch_all):
     if not os.path.exists(repo_cache_dir):
         os.makedirs(repo_cache_dir)
 
     need_fetch = False
     if not is_bare_git_repo(repo_cache_dir):
-        cmd = f'git init --bare {repo_cache_dir}'
-        await run_git_command(cmd, shell=True, cwd=global_cache_dir, stderr=subprocess.STDOUT)
-        cmd = 'git config remote.origin.url ' + url
-        await run_git_command(cmd, shell=True, cwd=repo_cache_dir, stderr=subprocess.STDOUT)
+        await run_git_command(['git', 'init', '--bare', repo_cache_dir], stderr=subprocess.STDOUT)
+        await run_git_command(
+            ['git', 'config', 'remote.origin.url', url], cwd=repo_cache_dir, stderr=subprocess.STDOUT
+        )
         need_fetch = True
     elif fetch_all:
         need_fetch = True
     else:
-        cmd = f'git rev-parse {ref_spec.rsplit()[-1]}'
+        # a full sha would be resolved without looking the object up, check the ref keeping it instead
+        need_fetch = not _has_ref(repo_cache_dir, _cache_ref(ref_spec))
+
+    if not need_fetch:
+        return
+
+    logging.debug(f'update git cache in {repo_cache_dir}')
+    # fetch from the named remote, git registers it as the promisor remote of the partial clone
+    filter_args = [f'--filter={GIT_CACHE_FILTER}'] if GIT_CACHE_FILTER else []
+    cmd = ['git', 'fetch'] + filter_args + ['--force', '--progress', '--update-head-ok', 'origin']
+    if not fetch_all:
+        # only fetch what was asked for, a commit is kept referenced so that gc does not prune it
+        target_ref_spec = f'+{ref_spec}:{_cache_ref(ref_spec)}' if is_git_sha(ref_spec) else ref_spec
         try:
             await run_git_command(
-                cmd, shell=True, cwd=repo_cache_dir, stderr=subprocess.STDOUT, suppress_error_log=True
+                cmd + [target_ref_spec], cwd=repo_cache_dir, stderr=subprocess.STDOUT, suppress_error_log=True
             )
+            return
         except subprocess.CalledProcessError:
-            need_fetch = True
-
-    if need_fetch:
-        logging.debug(f'update git cache in {repo_cache_dir}')
-        ref_spec = '+refs/heads/*:refs/remotes/origin/*'
-        cmd = f'git fetch --force --progress --update-head-ok -- {url} {ref_spec}'
-        await run_git_command(cmd, shell=True, cwd=repo_cache_dir, stderr=subprocess.STDOUT)
-    return repo_cache_dir
+            # servers may refuse to serve commits which are not advertised
+            logging.debug(f'failed to fetch {ref_spec} into git cache, fetch all branches instead')
+    await run_git_command(cmd + [ALL_BRANCHES_REF_SPEC], cwd=repo_cache_dir, stderr=subprocess.STDOUT)
 
 
-async def run_git_command(cmd: str, *args, **kwargs):
+async def run_git_command(cmd: list, *args, **kwargs):
     suppress_error_log = kwargs.get('suppress_error_log', False)
     if suppress_error_log:
         kwargs.pop('suppress_error_log')
@@ -68,17 +128,25 @@ async def run_git_command(cmd: str, *args, **kwargs):
     return output.decode()
 
 
-async def apply_patches(patch_path: str, cwd: str):
-    expanded_patch_paths = list(glob(patch_path))
-    expanded_patch_paths.sort()
+async def _expand_patch_path(patch_path: str):
+    if has_magic(patch_path):
+        return sorted(await to_thread(glob, patch_path))
+    return [patch_path] if os.path.exists(patch_path) else []
+
 
-    if not expanded_patch_paths:
-        raise HabitatException('failed to match valid patch paths.')
+async def apply_patches(patch_paths: list, cwd: str):
+    # patterns are expanded concurrently, the patches are still applied in the order of their patterns
+    expanded_patch_paths = []
+    for matched_paths in await asyncio.gather(*(_expand_patch_path(p) for p in patch_paths)):
+        if not matched_paths:
+            raise HabitatException('failed to match valid patch paths.')
+        expanded_patch_paths.extend(matched_paths)
 
     apply = 'apply'
     if await is_git_user_set():
         apply = 'am'
     try:
+        # all patches are applied by a single git process, in the order of their patterns
         await async_check_output(
             ['git', apply] + expanded_patch_paths, cwd=cwd, stderr=subprocess.STDOUT
         )
@@ -95,7 +163,6 @@ class GitFetcher(Fetcher):
             url = convert_git_url_to_http(url, options.git_auth)
 
         logging.info(f'Fetch git repository {url if DEBUG else self.component.url} to {target_dir}')
-        new_init = False
         if not options.clean and (not options.raw or self.component.is_root):
             source_dir = target_dir
         else:
@@ -103,31 +170,40 @@ class GitFetcher(Fetcher):
                 root_dir=root_dir, name=f'GIT-FETCHER-{self.component.name.replace("/", "_")}'
             )
 
-        if not is_git_root(source_dir):
-            cmd = f'git init {source_dir}'
-            await run_git_command(cmd, shell=True, stderr=subprocess.STDOUT)
-            new_init = True
-        elif not is_git_repo_valid(source_dir):
+        new_init = not is_git_root(source_dir)
+        if not new_init and not is_git_repo_valid(source_dir):
             # Check if alternates is set to the right path, since the global cache might be cleaned.
             # If the alternates are not available, the git repository need to be re-created to avoid losing objects.
             rmtree(source_dir)
-            cmd = f'git init {source_dir}'
-            await run_git_command(cmd, shell=True, stderr=subprocess.STDOUT)
             new_init = True
 
-        remote = await run_git_command('git remote', shell=True, cwd=source_dir, stderr=subprocess.STDOUT)
-        remote = remote.strip()
+        configs = []
+        # fix reserved name in file path causing the checkout command complain "error: invalid path..." on windows
+        if sys.platform == 'win32':
+            configs.append(['core.protectNTFS', 'false'])
+        # blobs missing from a partial global cache are fetched lazily from the remote
+        promisor = not options.disable_cache and GIT_CACHE_FILTER
+        if new_init:
+            # a fresh repository has no remote yet, configure it instead of probing
+            await run_git_command(['git', 'init', source_dir], stderr=subprocess.STDOUT)
+            remote = ''
+        else:
+            remote = await run_git_command(['git', 'remote'], cwd=source_dir, stderr=subprocess.STDOUT)
+            remote = remote.strip()
         if not remote:
-            cmd = 'git config remote.origin.url ' + url
-            await run_git_command(cmd, shell=True, cwd=source_dir, stderr=subprocess.STDOUT)
+            configs.append(['remote.origin.url', url])
             remote = 'origin'
+        if promisor:
+            configs.append([f'remote.{remote}.promisor', 'true'])
+        for config in configs:
+            await run_git_command(['git', 'config'] + config, cwd=source_dir, stderr=subprocess.STDOUT)
 
         # if a repository was fetched before git lfs install,
         # files tracked by lfs will be replaced by file pointer
         if getattr(self.component, 'enable_lfs', False):
             try:
                 await run_git_command(
-                    'git lfs install', shell=True, cwd=source_dir, stderr=subprocess.STDOUT, suppress_error_log=True
+                    ['git', 'lfs', 'install'], cwd=source_dir, stderr=subprocess.STDOUT, suppress_error_log=True
                 )
             except subprocess.CalledProcessError as e:
                 logging.warning(f'{e.output.decode()} This may caused by: '
@@ -149,52 +225,50 @@ class GitFetcher(Fetcher):
                         raise HabitatException(
                             f'directory {target_dir} exist, try use "-f/--force" flag or remove it manually')
             else:
-                cmd = 'git clean -fd && git reset --hard'
-                await run_git_command(cmd, shell=True, cwd=source_dir, stderr=subprocess.STDOUT)
+                await run_git_command(['git', 'clean', '-fd'], cwd=source_dir, stderr=subprocess.STDOUT)
+                await run_git_command(['git', 'reset', '--hard'], cwd=source_dir, stderr=subprocess.STDOUT)
 
         logging.debug(f'Fetch git repository {url if DEBUG else self.component.url} in {source_dir}')
-        # fix reserved name in file path causing the checkout command complain "error: invalid path..." on windows
-        if sys.platform == 'win32':
-            cmd = 'git config core.protectNTFS false'
-            await run_git_command(cmd, shell=True, cwd=source_dir, stderr=subprocess.STDOUT)
-
         # Enable sparse checkouts
         if hasattr(self.component, 'paths'):
-            cmd = f'git sparse-checkout set {" ".join(self.component.paths)}'
+            cmd = ['git', 'sparse-checkout', 'set'] + self.component.paths
         else:
             # Repopulate the working directory with all files, disabling sparse checkouts.
-            cmd = 'git sparse-checkout disable'
+            cmd = ['git', 'sparse-checkout', 'disable']
         try:
-            await run_git_command(cmd, shell=True, cwd=source_dir, stderr=subprocess.STDOUT)
+            await run_git_command(cmd, cwd=source_dir, stderr=subprocess.STDOUT)
         except subprocess.CalledProcessError:
             # Since sparse checkout is not supported by old version of git, just give a warning here.
             logging.warning(f'sparse checkout is not supported, skip cmd {cmd}')
 
         if hasattr(self.component, 'commit'):
             commit = self.component.commit
-            ref_spec = commit if len(commit) == 40 else get_full_commit_id(commit, url)
-            checkout_args = 'FETCH_HEAD'
+            cache_dir = None if options.disable_cache else os.path.realpath(
+                os.path.expandvars(os.path.expanduser(options.cache_dir))
+            )
+            ref_spec = await to_thread(get_full_commit_id, commit, url, cache_dir)
+            checkout_args = ['FETCH_HEAD']
         elif hasattr(self.component, 'branch'):
             ref_spec = f'+refs/heads/{self.component.branch}:refs/remotes/{remote}/{self.component.branch}'
-            checkout_args = f'-B {self.component.branch} refs/remotes/{remote}/{self.component.branch}'
+            checkout_args = ['-B', self.component.branch, f'refs/remotes/{remote}/{self.component.branch}']
         elif hasattr(self.component, 'tag'):
             ref_spec = f'+refs/tags/{self.component.tag}:refs/tag/{self.component.tag}'
-            checkout_args = self.component.tag
+            checkout_args = [self.component.tag]
         elif new_init:
             remote = 'origin'
-            cmd = f'git remote show {remote}'
+            # untranslated output is parsed
             output = await run_git_command(
-                cmd, shell=True, cwd=source_dir, stderr=subprocess.STDOUT, env={'LANG': 'en_US.UTF-8'}
+                ['git', 'remote', 'show', remote], cwd=source_dir, stderr=subprocess.STDOUT,
+                env={**os.environ, 'LC_ALL': 'C'}
             )
-            res = re.search(r'HEAD branch: (\S+)', output)
+            res = _HEAD_BRANCH_RE.search(output)
             if not res:
                 raise HabitatException(f'HEAD branch of remote repository {remote} not found')
             branch_name = res[1]
             ref_spec = f'+refs/heads/{branch_name}:refs/remotes/{remote}/{branch_name}'
-            checkout_args = f'-B {branch_name} refs/remotes/{remote}/{branch_name}'
+            checkout_args = ['-B', branch_name, f'refs/remotes/{remote}/{branch_name}']
         else:
-            cmd = 'git status -uno'
-            output = await run_git_command(cmd, shell=True, cwd=target_dir, stderr=subprocess.STDOUT)
+            output = await run_git_command(['git', 'status', '-uno'], cwd=target_dir, stderr=subprocess.STDOUT)
             if output.startswith('HEAD detached at'):
                 # HEAD is detached, do nothing
                 return [target_dir]
@@ -203,14 +277,14 @@ class GitFetcher(Fetcher):
             else:
                 raise HabitatException(output)
             ref_spec = f'+refs/heads/{branch_name}:refs/remotes/{remote}/{branch_name}'
-            checkout_args = f'-B {branch_name} refs/remotes/{remote}/{branch_name}'
+            checkout_args = ['-B', branch_name, f'refs/remotes/{remote}/{branch_name}']
 
         fetch_all = self.component.fetch_mode == 'all'
         if self.component.is_root or fetch_all:
-            ref_spec = "'+refs/heads/*:refs/remotes/origin/*'"
-            depth_arg = ""
+            ref_spec = ALL_BRANCHES_REF_SPEC
+            depth_args = []
         else:
-            depth_arg = '--depth=1 --no-tags' if options.no_history else ''
+            depth_args = ['--depth=1', '--no-tags'] if options.no_history else []
 
         if not options.disable_cache:
             global_cache_dir = os.path.expanduser(os.path.join(options.cache_dir, 'git'))
@@ -220,22 +294,22 @@ class GitFetcher(Fetcher):
             )
             await set_git_alternates(source_dir, reference_objects_dir)
 
-        cmd = f'git fetch {depth_arg} --force --progress --update-head-ok -- {url} {ref_spec}'
-        await run_git_command(cmd, shell=True, cwd=source_dir, retry=1, stderr=subprocess.STDOUT)
+        cmd = ['git', 'fetch'] + depth_args + ['--force', '--progress', '--update-head-ok', '--', url, ref_spec]
+        await run_git_command(cmd, cwd=source_dir, retry=1, stderr=subprocess.STDOUT)
 
         if options.raw and not os.path.exists(target_dir):
             os.mkdir(target_dir)
         if options.raw:
             if not os.path.exists(target_dir):
                 os.mkdir(target_dir)
-            cmd = f'git --work-tree={target_dir} checkout FETCH_HEAD -- .'
+            cmd = ['git', f'--work-tree={target_dir}', 'checkout', 'FETCH_HEAD', '--', '.']
         else:
-            cmd = f'git checkout {checkout_args}'
-        await run_git_command(cmd, shell=True, cwd=source_dir, stderr=subprocess.STDOUT)
+            cmd = ['git', 'checkout'] + checkout_args
+        await run_git_command(cmd, cwd=source_dir, stderr=subprocess.STDOUT)
 
         if getattr(self.component, 'enable_lfs', False):
             try:
-                await run_git_command('git lfs pull', shell=True, cwd=source_dir, stderr=subprocess.STDOUT)
+                await run_git_command(['git', 'lfs', 'pull'], cwd=source_dir, stderr=subprocess.STDOUT)
             except subprocess.CalledProcessError as e:
                 raise HabitatException(f'{e} This may caused by not installing git lfs')
 
@@ -243,10 +317,9 @@ class GitFetcher(Fetcher):
         if not patch_path:
             pass
         elif isinstance(patch_path, str):
-            await apply_patches(patch_path, source_dir)
+            await apply_patches([patch_path], source_dir)
         elif isinstance(patch_path, list):
-            for p in patch_path:
-                await apply_patches(p, source_dir)
+            await apply_patches(patch_path, source_dir)
 
         if target_dir != source_dir and not options.raw:
             move(source_dir, target_dir)
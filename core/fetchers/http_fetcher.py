@@ -6,6 +6,7 @@ import asyncio
 import functools
 import hashlib
 import logging
+import math
 import os
 import platform
 import shutil
@@ -14,22 +15,30 @@ from pathlib import Path
 from urllib.parse import urlsplit
 
 from core.common.cache_mixin import CacheMixin
-from core.common.http_status import client_error, server_error, success
+from core.common.http_status import success
 from core.common.httpx_client import HttpxClient
 from core.exceptions import HabitatException
 from core.fetchers.fetcher import Fetcher
-from core.settings import DEBUG
-from core.utils import ProgressBar, async_check_output, create_temp_dir, extract_archive
+from core.settings import CHUNKED_TRANSMISSION, DEBUG, MAX_DOWNLOAD_PARTS
+from core.utils import (ProgressBar, async_check_output, create_temp_dir, extract_archive, file_hexdigest,
+                        get_archive_format, link_or_copy, open_tarfile_extraction, reflink_or_copy, to_thread)
 
 FILE_PART_SIZE = 20 * 1024 * 1024
 
 
 def check_sha256(path: str, sha256: str):
-    h = hashlib.sha256()
+    return file_hexdigest(path, 'sha256') == sha256
+
+
+def _hash_file_range(hasher, path: str, start: int, length: int):
     with open(path, 'rb') as f:
-        for block in iter(lambda: f.read(FILE_PART_SIZE), b''):
-            h.update(block)
-    return h.hexdigest() == sha256
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(length, 4096 * 1024))
+            if not block:
+                break
+            hasher.update(block)
+            length -= len(block)
 
 
 def _get_content_length(header):
@@ -48,10 +57,12 @@ def convert_url_to_cache_path(url: str) -> str:
 
 
 def move_to_target_dir(temp_dir, target_dir, is_single_file):
-    sub_dirs = os.listdir(temp_dir)
-    # remove nested folder
-    if len(sub_dirs) == 1 and (os.path.isdir(os.path.join(temp_dir, sub_dirs[0])) or is_single_file):
-        shutil.move(os.path.join(temp_dir, sub_dirs[0]), target_dir)
+    # scandir reports the entry types along with the names, so no extra stat is needed for a single entry
+    with os.scandir(temp_dir) as it:
+        sub_dirs = list(it)
+    # remove nested folder, shutil.move renames before falling back to a copy across filesystems
+    if len(sub_dirs) == 1 and (sub_dirs[0].is_dir() or is_single_file):
+        shutil.move(sub_dirs[0].path, target_dir)
     else:
         shutil.move(temp_dir, target_dir)
 
@@ -101,106 +112,164 @@ class HttpFetcher(Fetcher, CacheMixin):
         self._update_download_url(self.component.url)
         file_name = self.path_url.split('/')[-1]
         temp_dir = create_temp_dir(os.path.dirname(target_dir), name='HTTP')
-        file_path = os.path.join(temp_dir, file_name)
-
-        # retrieve file from cache, the key is the url of the dependency.
-        skip_download = False
-        cache = self.get_from_cache(convert_url_to_cache_path(self.url))
-        if cache:
-            shutil.copy2(cache, file_path)
-            skip_download = True
-
-        header = {}
-        if not skip_download:
-            header = await self._send_head_request(item)
-        partial = _check_range_supported(header)
-        size = _get_content_length(header)
-
-        if skip_download:
-            pass
-        elif partial and size:
-            remained_size = size
-            download_futures = []
-            start = 0
-            progress_bar = ProgressBar(total=size, title=f"Download {item}" if DEBUG else "")
-            while remained_size > 0:
-                chunk_len = min(FILE_PART_SIZE, remained_size)
-                end = start + chunk_len
-                coroutine = asyncio.create_task(self._download_part(
-                    item, start, end - 1,
-                    functools.partial(progress_bar.update, int(chunk_len * 0.8))
-                ))
-                download_futures.append(coroutine)
-                start = end
-                remained_size -= chunk_len
-
-            results = await asyncio.gather(*download_futures)
-
-            with open(file_path, 'wb') as f:
-                for r in results:
-                    result, _ = r
-                    f.write(result)
-                    progress_bar.update(int(len(result) * 0.2))
-        else:
-            await self._download_entire(file_path, self.path_url)
-
-        sha256 = getattr(component, 'sha256', None)
-        is_sha256_match = check_sha256(file_path, sha256)
-
-        if sha256 and not is_sha256_match:
-            raise HabitatException(f'{self.url}\'s sha256 does not match {target_dir}\'s sha256')
-
-        # store file to cache, the key is the url of the dependency.
-        self.put_to_cache(convert_url_to_cache_path(self.url), path=file_path)
-
-        paths = getattr(component, 'paths', [])
-        if getattr(component, 'decompress', True):
-            extract_archive(file_path, temp_dir, paths)
-
-        if not paths:
-            move_to_target_dir(temp_dir, target_dir, is_single_file)
-
-        for path in paths:
-            move_to_target_dir(os.path.join(temp_dir, path), target_dir, False)
-
-        shutil.rmtree(temp_dir, ignore_errors=True)
-
-    async def _download_part(self, item: str, start, end, callback=None):
-        logging.debug(f'download part [{start}, {end}] of {item}')
+        # the staging directory is removed even if the download fails, so no partial files are left behind
         try:
-            # TODO(zouzhecheng): delete this when http client refactored.
-            if sys.version_info[0:3] < (3, 8, 0) and platform.system().lower() == 'linux':
-                url = f"{self.base_url}{self.path_url}"
-                data = await async_check_output(
-                    f"curl -k -s -S {url} --request GET --fail --stderr - --retry 3 --location "
-                    f"--header 'Range: bytes={start}-{end}'",
-                    shell=True
-                )
+            file_path = os.path.join(temp_dir, file_name)
+
+            # retrieve file from cache, the key is the url of the dependency.
+            skip_download = False
+            cache = self.get_from_cache(convert_url_to_cache_path(self.url))
+            if cache:
+                # an archive is only read before being removed, so it can share the inode of the cache entry
+                if getattr(component, 'decompress', True):
+                    link_or_copy(cache, file_path)
+                else:
+                    reflink_or_copy(cache, file_path)
+                skip_download = True
+
+            header = {}
+            # the HEAD request only tells whether the file can be downloaded in ranges, save the round trip
+            # if that is disabled
+            if not skip_download and CHUNKED_TRANSMISSION:
+                header = await self._send_head_request(item)
+            partial = _check_range_supported(header)
+            size = _get_content_length(header)
+
+            sha256 = getattr(component, 'sha256', None)
+            paths = getattr(component, 'paths', [])
+            extracted = False
+            # downloaded data is hashed as it arrives instead of reading the whole file again afterwards
+            hasher = hashlib.sha256() if sha256 and not skip_download else None
+            if skip_download:
+                pass
+            elif partial and size:
+                progress_bar = ProgressBar(total=size, title=f"Download {item}" if DEBUG else "")
+                # parts are written into their ranges of a preallocated file as they arrive instead of being
+                # held in memory until all of them are downloaded
+                with open(file_path, 'wb') as f:
+                    f.truncate(size)
+                # parts are at least FILE_PART_SIZE long, larger files are split into at most MAX_DOWNLOAD_PARTS parts
+                # rather than into more and more requests competing for the same bandwidth
+                part_count = min(MAX_DOWNLOAD_PARTS, math.ceil(size / FILE_PART_SIZE))
+                part_size = math.ceil(size / part_count)
+                download_futures = []
+                for start in range(0, size, part_size):
+                    end = min(start + part_size, size)
+                    download_futures.append(asyncio.create_task(self._download_part(
+                        item, file_path, start, end - 1, functools.partial(progress_bar.update, end - start)
+                    )))
+
+                try:
+                    # parts finish in any order, each one is hashed once all parts before it are downloaded,
+                    # while it is still in the page cache and the following parts are downloading
+                    for future in download_futures:
+                        start, end = await future
+                        if hasher:
+                            await to_thread(_hash_file_range, hasher, file_path, start, end + 1 - start)
+                except BaseException as e:
+                    for future in download_futures:
+                        future.cancel()
+                    raise e
+            elif self.cache_dir is None and not is_single_file and get_archive_format(file_name) == 'tar':
+                # nothing keeps the archive, so it is extracted while being downloaded instead of written and read again
+                try:
+                    await self._download_and_extract(file_name, temp_dir, paths, hasher)
+                    extracted = True
+                except NotImplementedError:
+                    # the event loop can not run subprocesses, e.g. the selector event loop on Windows
+                    await self._download_entire(file_path, self.path_url, hasher)
             else:
-                _, _, data = await self.download_client.async_request(
-                    'GET', self.path_url,
-                    extra_headers={'Range': f'bytes={start}-{end}'}, retry=2, timeout=600
+                await self._download_entire(file_path, self.path_url, hasher)
+
+            if not sha256:
+                pass
+            elif hasher:
+                is_sha256_match = hasher.hexdigest() == sha256
+            else:
+                # hashing a large archive would block the event loop and the other downloads with it
+                is_sha256_match = await to_thread(check_sha256, file_path, sha256)
+            if sha256 and not is_sha256_match:
+                raise HabitatException(f'{self.url}\'s sha256 does not match {target_dir}\'s sha256')
+
+            # store file to cache, the key is the url of the dependency. archives are removed after being extracted,
+            # so they can be hard linked into the cache safely.
+            if not skip_download:
+                self.put_to_cache(
+                    convert_url_to_cache_path(self.url), path=file_path, hardlink=getattr(component, 'decompress', True)
                 )
+
+            if getattr(component, 'decompress', True) and not extracted:
+                extract_archive(file_path, temp_dir, paths)
+
+            if not paths:
+                move_to_target_dir(temp_dir, target_dir, is_single_file)
+
+            for path in paths:
+                move_to_target_dir(os.path.join(temp_dir, path), target_dir, False)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    async def _download_part(self, item: str, file_path: str, start, end, callback=None):
+        logging.debug(f'download part [{start}, {end}] of {item}')
+        try:
+            with open(file_path, 'r+b') as f:
+                f.seek(start)
+                # TODO(zouzhecheng): delete this when http client refactored.
+                if sys.version_info[0:3] < (3, 8, 0) and platform.system().lower() == 'linux':
+                    url = f"{self.base_url}{self.path_url}"
+                    data = await async_check_output(
+                        f"curl -k -s -S {url} --request GET --fail --stderr - --retry 3 --location "
+                        f"--header 'Range: bytes={start}-{end}'",
+                        shell=True
+                    )
+                    f.write(data)
+                else:
+                    await self.download_client.async_stream(
+                        self.path_url, f.write, extra_headers={'Range': f'bytes={start}-{end}'}, timeout=600
+                    )
             if callback:
                 callback()
             logging.debug(f'part [{start}, {end}] of {item} is downloaded')
-            return data, (start, end)
+            return start, end
         except Exception as e:
             raise HabitatException(f'Failed to download part {start}:{end} of object {item}') from e
 
-    async def _download_entire(self, target_dir: str, url: str):
+    async def _download_entire(self, target_dir: str, url: str, hasher=None):
         """
         if client can not get content-length field by sending a HEAD request,
         just download the file straight away without setting up a progress bar.
         """
-        resp, _, data = await self.download_client.async_request('GET', url)
-        if server_error(resp.status_code) or client_error(resp.status_code):
-            raise HabitatException(f'got a status code {resp.status_code} when downloading {url}')
-        if success(resp.status_code):
-            pass
-
         with open(target_dir, 'wb') as f:
-            f.write(data)
+            def write(block):
+                f.write(block)
+                if hasher:
+                    hasher.update(block)
+
+            await self.download_client.async_stream(url, write)
+
+    async def _download_and_extract(self, file_name: str, dst: str, paths: list, hasher=None):
+        process = await open_tarfile_extraction(file_name, dst, paths)
+        try:
+            async def write(block):
+                process.stdin.write(block)
+                if hasher:
+                    hasher.update(block)
+                # wait for tar while the pipe is full instead of blocking the event loop and the other downloads
+                await process.stdin.drain()
+
+            await self.download_client.async_stream(self.path_url, write)
+            process.stdin.close()
+            returncode = await process.wait()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            # tar stopped reading, the archive is broken
+            raise HabitatException(f'failed to extract {file_name}, tar exited with {await process.wait()}') from e
+        except BaseException:
+            if process.returncode is None:
+                process.kill()
+            await process.wait()
+            raise
+        if returncode != 0:
+            raise HabitatException(f'failed to extract {file_name}, tar exited with {returncode}')
 
     async def _send_head_request(self, item: str):
         # check if server supports Content-Length and Accept-Ranges
@@ -8,7 +8,7 @@ import shutil
 
 from core.exceptions import HabitatException
 from core.fetchers.fetcher import Fetcher
-from core.utils import create_symlink
+from core.utils import create_symlink, reflink_or_copy, to_thread
 
 
 class LocalFetcher(Fetcher):
@@ -36,7 +36,10 @@ class LocalFetcher(Fetcher):
                     logging.debug(f'{dst} is an existing symlink, remove it.')
                     os.remove(dst)
                 logging.debug(f'Copying {src} to {dst} instead of creating symlink.')
-                shutil.copytree(src, dst, symlinks=True, dirs_exist_ok=True)
+                # copying a large tree would block the event loop and every other fetch with it
+                await to_thread(
+                    shutil.copytree, src, dst, symlinks=True, dirs_exist_ok=True, copy_function=reflink_or_copy
+                )
                 continue
 
             # if dst is link, delete it, as it might be an old link
@@ -3,7 +3,6 @@
 # LICENSE file in the root directory of this source tree.
 
 import asyncio
-import copy
 import logging
 import platform
 import sys
@@ -26,7 +25,8 @@ def load_commands(argument_parser: ArgumentParser, command_classes):
         logging.debug(f'register command {c}')
         parser = sub_parsers.add_parser(c.name, help=c.help)
 
-        for arg in c.args + copy.deepcopy(c.__base__.args):
+        # arguments are only read, the concatenation is a new list already
+        for arg in c.args + c.__base__.args:
             kw_args = {k: v for k, v in arg.items() if k != 'flags'}
             parser.add_argument(*arg.get('flags'), **kw_args)
         parser.set_defaults(command=c())
@@ -61,6 +61,13 @@ def main():
             if platform.system() == "Windows":
                 # Working around "Asyncio Event Loop is Closed" on Windows
                 asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+            else:
+                try:
+                    # optional, install habitat[uvloop] for a faster event loop
+                    import uvloop
+                    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+                except ImportError:
+                    pass
 
             asyncio.run(args.command.run_command(args))
         except Exception as e:
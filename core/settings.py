@@ -9,15 +9,31 @@ DEBUG = os.environ.get("HABITAT_DEBUG", None) == 'true'
 COMPATIBLE_CHECK = os.environ.get("HABITAT_COMPATIBLE_CHECK", None) != 'false'
 
 DEFAULT_CONFIG_FILE_NAME = '.habitat'
-DEFAULT_DEPS_CACHE_FILE_NAME = '.habitat_entries'
 
-GLOBAL_CACHE_DIR = os.path.join(os.environ.get("HOME", tempfile.gettempdir()), '.habitat_cache')
+# gettempdir probes candidate directories by creating files in them, only call it if there is no home directory
+_home_dir = os.environ.get("HOME")
+GLOBAL_CACHE_DIR = os.environ.get('HABITAT_CACHE_DIR') or os.path.join(
+    _home_dir if _home_dir is not None else tempfile.gettempdir(), '.habitat_cache'
+)
 USER_CONFIG_STORAGE_PATH = os.path.join(GLOBAL_CACHE_DIR, 'meta', 'config')
 
 CACHE_DIR_PREFIX = 'TEMP-HABITAT-'
 
 CHUNKED_TRANSMISSION = os.environ.get('HABITAT_CHUNKED_TRANSMISSION', 'true').lower() == 'true'
 
+# partial clone filter of the global git cache, blobs are fetched lazily by the repositories borrowing from it
+GIT_CACHE_FILTER = os.environ.get('HABITAT_GIT_CACHE_FILTER', 'blob:none')
+
 ENTRIES_CACHE_TAG_PREFIX = 'habitat_entries'
 
+MAX_CONCURRENCY = int(os.environ.get('HABITAT_CONCURRENCY', 50))
+MAX_FETCH_CONCURRENCY = int(os.environ.get('HABITAT_FETCH_CONCURRENCY', 16))
+if MAX_FETCH_CONCURRENCY < 1:
+    raise ValueError(f'HABITAT_FETCH_CONCURRENCY must be a positive integer, got {MAX_FETCH_CONCURRENCY}')
+# workers running blocking calls such as file copies off the event loop
+MAX_THREAD_POOL_SIZE = int(os.environ.get('HABITAT_THREAD_POOL_SIZE', 64))
+
+# maximum number of ranges a single http download is split into
+MAX_DOWNLOAD_PARTS = int(os.environ.get('HABITAT_DOWNLOAD_PARTS', 8))
+
 MAX_DEPENDENCY_WAIT_TIME = int(os.environ.get('HABITAT_MAX_DEPENDENCY_WAIT_TIME', 1200))
@@ -7,31 +7,57 @@
 # root of the source tree.
 
 import asyncio
+import bisect
+import contextlib
 import contextvars
 import functools
 import hashlib
+import importlib
 import inspect
 import logging
-import math
 import os
 import pkgutil
 import platform
 import posixpath
 import random
 import re
-import shlex
 import shutil
+import signal
 import stat
 import string
+import struct
 import subprocess
 import sys
+import threading
+import time
 import traceback
+import zlib
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from zipfile import ZipFile
+from zipfile import ZIP_STORED, BadZipFile, ZipFile
 
 from core.exceptions import HabitatException
-from core.settings import CACHE_DIR_PREFIX
+from core.settings import CACHE_DIR_PREFIX, MAX_THREAD_POOL_SIZE
+
+try:
+    import fcntl
+except ImportError:
+    # fcntl is not available on Windows
+    fcntl = None
+
+# ioctl request to share data blocks of a file with another file on copy-on-write filesystems, see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+_GITDIR_RE = re.compile(r'gitdir: (.*)')
+_MD5_HASH_RE = re.compile(r'^([a-fA-F\d]{32})$')
+_GIT_SHA_RE = re.compile(r'^[a-fA-F0-9]{6,40}$')
+
+
+@functools.lru_cache(maxsize=1)
+def _thread_pool():
+    # the default executor of a loop is limited to min(32, cpu + 4) workers, which are mostly blocked on IO here
+    return ThreadPoolExecutor(max_workers=MAX_THREAD_POOL_SIZE, thread_name_prefix='habitat')
 
 
 async def to_thread(func, *args, **kwargs):
@@ -47,7 +73,7 @@ async def to_thread(func, *args, **kwargs):
     loop = asyncio.get_running_loop()
     ctx = contextvars.copy_context()
     func_call = functools.partial(ctx.run, func, *args, **kwargs)
-    return await loop.run_in_executor(None, func_call)
+    return await loop.run_in_executor(_thread_pool(), func_call)
 
 
 def match_paths(path, match_list: list):
@@ -57,6 +83,29 @@ def match_paths(path, match_list: list):
     return False
 
 
+def _path_prefix(path):
+    parts = [p for p in convert_to_posix_path(os.path.normcase(path)).split('/') if p and p != '.']
+    return '/'.join(parts) + '/' if parts else ''
+
+
+def _path_matcher(match_list: list):
+    """
+    Returns a function telling whether a path is one of the paths in *match_list* or inside one of them, like
+    match_paths does. It bisects a sorted list of prefixes instead of comparing the path with every entry.
+    """
+    prefixes = []
+    for prefix in sorted({_path_prefix(p) for p in match_list}):
+        # drop prefixes inside another one, so the closest smaller prefix is the only candidate for a path
+        if not prefixes or not prefix.startswith(prefixes[-1]):
+            prefixes.append(prefix)
+
+    def match(path):
+        key = _path_prefix(path)
+        i = bisect.bisect_right(prefixes, key) - 1
+        return i >= 0 and key.startswith(prefixes[i])
+    return match
+
+
 def is_subdir(sub, parent):
     return os.path.commonpath([sub, parent]) == parent
 
@@ -67,32 +116,62 @@ def format_exception(e):
     return '\n'.join(msg)
 
 
-async def async_check_call(*args, retry=0, **kwargs):
-    remained_chances = retry + 1
-    while True:
-        try:
-            remained_chances -= 1
-            return await to_thread(check_call, *args, **kwargs)
-        except subprocess.CalledProcessError as e:
-            if remained_chances > 0:
-                logging.warning(f'Got an exception {e} during running command {args} {kwargs}, retry')
-            else:
-                raise e
+async def _run_subprocess(cmd, shell=False, stdout=None, **kwargs):
+    """Runs *cmd* in a subprocess driven by the event loop and returns its captured stdout.
 
+    Raises CalledProcessError like subprocess.check_output does.
+    """
+    logging.debug(f'Run command: {cmd} (kwargs: {kwargs}')
+    # a shell runs in a process group of its own, so a cancellation kills the commands it started and not only itself
+    kill_group = shell and os.name == 'posix'
+    if shell:
+        proc = await asyncio.create_subprocess_shell(cmd, stdout=stdout, start_new_session=kill_group, **kwargs)
+    else:
+        proc = await asyncio.create_subprocess_exec(*cmd, stdout=stdout, **kwargs)
+    try:
+        output, error = await proc.communicate()
+    except asyncio.CancelledError:
+        if proc.returncode is None:
+            with contextlib.suppress(ProcessLookupError):
+                if kill_group:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                else:
+                    proc.kill()
+        await proc.wait()
+        raise
+    logging.debug(f'Command {cmd} end')
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=output, stderr=error)
+    return output
 
-async def async_check_output(*args, retry=0, **kwargs):
+
+async def _run_with_retry(func, sync_func, cmd, retry, **kwargs):
     remained_chances = retry + 1
     while True:
         try:
             remained_chances -= 1
-            return await to_thread(check_output, *args, **kwargs)
+            try:
+                return await func(cmd, **kwargs)
+            except NotImplementedError:
+                # the selector event loop used on Windows can not run subprocesses, use a thread instead
+                return await to_thread(sync_func, cmd, **kwargs)
         except subprocess.CalledProcessError as e:
             if remained_chances > 0:
-                logging.warning(f'Got an exception {e} during running command {args} {kwargs}, retry')
+                logging.warning(f'Got an exception {e} during running command {cmd} {kwargs}, retry')
             else:
                 raise e
 
 
+async def async_check_call(cmd, retry=0, **kwargs):
+    await _run_with_retry(_run_subprocess, check_call, cmd, retry, **kwargs)
+
+
+async def async_check_output(cmd, retry=0, **kwargs):
+    return await _run_with_retry(
+        functools.partial(_run_subprocess, stdout=subprocess.PIPE), check_output, cmd, retry, **kwargs
+    )
+
+
 def check_output(*args, **kwargs):
     logging.debug(f'Run command: {args[0]} (args: {args} kwargs: {kwargs}')
     output = subprocess.check_output(*args, **kwargs)
@@ -143,7 +222,7 @@ def samefile(src, dst):
     return os.path.normcase(os.path.abspath(src)) == os.path.normcase(os.path.abspath(dst))
 
 
-def move(src, dst, copy_function=shutil.copy2):
+def move(src, dst, copy_function=None):
     """Recursively move a file or directory to another location. This is
     similar to the Unix "mv" command. Return the file or directory's
     destination.
@@ -162,13 +241,16 @@ def move(src, dst, copy_function=shutil.copy2):
 
     The optional `copy_function` argument is a callable that will be used
     to copy the source or it will be delegated to `copytree`.
-    By default, copy2() is used, but any function that supports the same
-    signature (like copy()) can be used.
+    By default, reflink_or_copy() is used, which clones the data on
+    copy-on-write filesystems and falls back to copy2(), but any function
+    that supports the same signature (like copy()) can be used.
 
     A lot more could be done here...  A look at a mv.c shows a lot of
     the issues this implementation glosses over.
 
     """
+    if copy_function is None:
+        copy_function = reflink_or_copy
     real_dst = dst
     if os.path.isdir(dst):
         if samefile(src, dst):
@@ -215,15 +297,77 @@ def move(src, dst, copy_function=shutil.copy2):
     return real_dst
 
 
-def rmtree(path, ignore_errors=False):
-    while os.path.exists(path):
+def reflink_or_copy(src, dst):
+    """Copy file src to dst, try a copy-on-write clone first (btrfs, XFS...) and fall back to a full copy."""
+    if fcntl and sys.platform.startswith('linux'):
         try:
-            shutil.rmtree(path, ignore_errors=ignore_errors)
-        except PermissionError as e:
-            error_file = e.filename
-            if os.path.exists(error_file):
-                os.chmod(error_file, stat.S_IWUSR)
-                os.remove(error_file)
+            with open(src, 'rb') as s, open(dst, 'wb') as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            shutil.copystat(src, dst)
+            return dst
+        except OSError:
+            pass
+    return shutil.copy2(src, dst)
+
+
+def link_or_copy(src, dst):
+    """Hard link file src to dst, fall back to reflink_or_copy if src and dst are not on the same filesystem."""
+    try:
+        os.link(src, dst)
+        return dst
+    except OSError:
+        # cross-device link or not supported by the filesystem
+        return reflink_or_copy(src, dst)
+
+
+def _remove_writable(remove, path, parent=None):
+    try:
+        remove(path)
+    except PermissionError:
+        # read-only entries can not be removed on Windows and entries of a read-only directory can not be removed on
+        # POSIX, make both writable and retry in place, a symlink is never chmod-ed as that would change its target
+        if parent is not None:
+            os.chmod(parent, stat.S_IMODE(os.stat(parent).st_mode) | stat.S_IRWXU)
+        if not os.path.islink(path):
+            os.chmod(path, stat.S_IMODE(os.lstat(path).st_mode) | stat.S_IWUSR)
+        remove(path)
+
+
+def _scandir_sorted(path):
+    with os.scandir(path) as it:
+        return sorted(it, key=lambda entry: entry.name)
+
+
+def _fast_rmtree(path, parent=None):
+    # read the whole directory before unlinking anything in it, then unlink in sorted order, which matches the
+    # order of the directory index on most filesystems and keeps its rebalancing cheap
+    try:
+        entries = _scandir_sorted(path)
+    except PermissionError:
+        os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) | stat.S_IRWXU)
+        entries = _scandir_sorted(path)
+    files = []
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            _fast_rmtree(entry.path, path)
+        else:
+            files.append(entry.path)
+    for file in files:
+        _remove_writable(os.unlink, file, path)
+    _remove_writable(os.rmdir, path, parent)
+
+
+def rmtree(path, ignore_errors=False):
+    if not os.path.exists(path):
+        return
+    if ignore_errors:
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.islink(path):
+        # like shutil.rmtree, never walk into the target of a symlink
+        raise OSError(f'Cannot call rmtree on a symbolic link: {path}')
+    else:
+        # permission errors are fixed during the single walk instead of restarting it for every read-only file
+        _fast_rmtree(path)
 
 
 def convert_to_posix_path(path):
@@ -231,29 +375,82 @@ def convert_to_posix_path(path):
 
 
 def get_head_commit_id(**kwargs):
-    return subprocess.check_output(['git', 'rev-parse', 'HEAD'], **kwargs).decode().strip()
+    # read-only, never take optional locks which could contend with other git processes
+    return subprocess.check_output(['git', '--no-optional-locks', 'rev-parse', 'HEAD'], **kwargs).decode().strip()
+
+
+@functools.lru_cache(maxsize=128)
+def _ls_remote(url):
+    return subprocess.check_output(["git", "ls-remote", url], stderr=subprocess.STDOUT).decode()
 
 
-def get_full_commit_id(short_id, url):
-    cmd = ["git", "ls-remote", url]
-    output = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-    for line in output.decode().splitlines():
+def _commit_id_cache_path(cache_dir, short_id, url):
+    # full commit ids resolved from short ones, a commit id never changes so the entries are never invalidated
+    return os.path.join(cache_dir, 'commits', hashlib.blake2b(url.encode(), digest_size=8).hexdigest(), short_id)
+
+
+def _read_cached_commit_id(cache_dir, short_id, url):
+    try:
+        with open(_commit_id_cache_path(cache_dir, short_id, url), 'r') as f:
+            full_id = f.read().strip()
+    except OSError:
+        return None
+    return full_id if len(full_id) == 40 and is_git_sha(full_id) and full_id.startswith(short_id) else None
+
+
+def _write_cached_commit_id(cache_dir, short_id, url, full_id):
+    cache_path = _commit_id_cache_path(cache_dir, short_id, url)
+    tmp_path = f'{cache_path}.{random_string()}'
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(tmp_path, 'w') as f:
+            f.write(full_id)
+        # concurrent syncs resolve to the same id, so whichever rename wins is fine
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logging.debug(f'failed to cache commit id {full_id}: {e}')
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def get_full_commit_id(short_id, url, cache_dir=None):
+    """
+    resolve a short commit id on the remote. if cache_dir is given, resolved ids are kept on disk below it.
+    """
+    if len(short_id) == 40 and is_git_sha(short_id):
+        return short_id
+
+    # the short id is used as a file name, so only hex ids are cached
+    cacheable = cache_dir is not None and is_git_sha(short_id)
+    full_id = _read_cached_commit_id(cache_dir, short_id, url) if cacheable else None
+    if full_id:
+        return full_id
+
+    # ls-remote only filters by ref name, so the refs of a remote are listed once and reused for every lookup
+    for line in _ls_remote(url).splitlines():
         if line.startswith(short_id):
-            return line.split()[0].strip()
+            full_id = line.split()[0].strip()
+            # only a prefix of the commit id itself never goes stale, unlike a ref pointing to it
+            if cacheable and len(full_id) == 40 and is_git_sha(full_id) and full_id.startswith(short_id):
+                _write_cached_commit_id(cache_dir, short_id, url, full_id)
+            return full_id
     raise Exception(f'commit id {short_id} not found on remote')
 
 
 def ignore_paths_in_git(root_dir: str, paths: list, ignore_errors=False):
+    # ignore fetched files in parent repository
+    rel_paths = [Path(relative_path(root_dir, p)).as_posix() if os.path.isabs(p) else p for p in paths]
+
+    # query all paths with one git process, it prints only the paths that are already ignored
+    proc = subprocess.run(
+        ['git', 'check-ignore', '--stdin', '-z'], cwd=root_dir, input=''.join(p + '\0' for p in rel_paths).encode(),
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    already_ignored = set(proc.stdout.decode().split('\0')) if proc.returncode == 0 else set()
+
     ignored_paths = []
-    for path in paths:
-        # ignore fetched files in parent repository
-        if os.path.isabs(path):
-            path = relative_path(root_dir, path)
-            path = Path(path).as_posix()
-        cmd = f'git check-ignore -q {path}'
-        try:
-            check_call(cmd, shell=True, cwd=root_dir, stderr=subprocess.DEVNULL)
-        except subprocess.CalledProcessError:
+    for path in rel_paths:
+        if path not in already_ignored:
             logging.debug(f'path {path} will be ignored in main repository')
             ignored_paths.append('/' + path)
 
@@ -261,7 +458,7 @@ def ignore_paths_in_git(root_dir: str, paths: list, ignore_errors=False):
         git_dir = Path(root_dir) / Path('.git')
         if os.path.isfile(git_dir):
             with open(git_dir, 'r') as f:
-                matches = re.match(r'gitdir: (.*)', f.read())
+                matches = _GITDIR_RE.match(f.read())
                 if not matches:
                     logging.warning(f'unrecognized git dir {git_dir}')
                 git_dir = matches.group(1).strip()
@@ -269,12 +466,19 @@ def ignore_paths_in_git(root_dir: str, paths: list, ignore_errors=False):
         if not os.path.exists(os.path.dirname(exclude_file)):
             os.makedirs(os.path.dirname(exclude_file))
 
+        existing_lines = set()
+        ends_with_newline = True
         if os.path.exists(exclude_file):
             with open(exclude_file, 'r') as f:
-                ignored_paths = set(ignored_paths + [line.strip() for line in f.readlines() if line.strip()])
+                content = f.read()
+            existing_lines = {line.strip() for line in content.splitlines()}
+            ends_with_newline = not content or content.endswith('\n')
 
-        with open(exclude_file, 'w') as f:
-            f.write('\n'.join(ignored_paths) + '\n')
+        # only append the new entries, the existing lines, their order and comments are kept untouched
+        new_lines = [p for p in dict.fromkeys(ignored_paths) if p not in existing_lines]
+        if new_lines:
+            with open(exclude_file, 'a') as f:
+                f.write(('' if ends_with_newline else '\n') + '\n'.join(new_lines) + '\n')
 
     except Exception as e:
         if ignore_errors:
@@ -284,7 +488,7 @@ def ignore_paths_in_git(root_dir: str, paths: list, ignore_errors=False):
 
 
 def is_md5_hash(val) -> bool:
-    return bool(re.match(r"^([a-fA-F\d]{32})$", val))
+    return bool(_MD5_HASH_RE.match(val))
 
 
 def relative_path(base, sub):
@@ -292,16 +496,25 @@ def relative_path(base, sub):
     return os.path.relpath(sub, common)
 
 
-def get_md5_of_file(path):
-    m = hashlib.md5()
+def file_hexdigest(path, name):
     with open(path, 'rb') as f:
+        if hasattr(hashlib, 'file_digest'):
+            # hashes the file in C without handing every block to python, available since python 3.11
+            return hashlib.file_digest(f, name).hexdigest()
+        h = hashlib.new(name)
+        # read into one reused buffer instead of allocating a new bytes object per block
+        buffer = bytearray(16 * 1024 * 1024)
+        view = memoryview(buffer)
         while True:
-            data = f.read(4096 * 1024)
-            if not data:
+            size = f.readinto(buffer)
+            if not size:
                 break
-            m.update(data)
+            h.update(view[:size])
+        return h.hexdigest()
+
 
-    return m.hexdigest()
+def get_md5_of_file(path):
+    return file_hexdigest(path, 'md5')
 
 
 def create_symlink(src_path, dst_path):
@@ -316,9 +529,13 @@ def create_symlink(src_path, dst_path):
         logging.info(f'Symbolic link created from {dst_path} to {src_path}')
 
 
+@functools.lru_cache(maxsize=256)
+def _combined_pattern(patterns: tuple):
+    return re.compile("(" + ")|(".join(patterns) + ")")
+
+
 def match_patterns(target, patterns):
-    combined = "(" + ")|(".join(patterns) + ")"
-    if re.match(combined, target):
+    if _combined_pattern(tuple(patterns)).match(target):
         return True
     return False
 
@@ -333,57 +550,57 @@ def is_http_url(url):
 
 def is_git_sha(revision):
     """Returns true if the given string is a valid hex-encoded sha"""
-    return re.match('^[a-fA-F0-9]{6,40}$', revision) is not None
+    return _GIT_SHA_RE.match(revision) is not None
 
 
 def random_string(size=8, chars=string.ascii_letters + string.digits):
-    return ''.join(random.choice(chars) for _ in range(size))
+    return ''.join(random.choices(chars, k=size))
 
 
-def is_git_root(path):
-    if not is_git_repo(path):
-        return False
+def _git_probe(path):
+    """Returns (is_bare, git_dir, top_level) for *path*, or None if it is not in a git repository.
 
-    return Path(git_root_dir(path)) == Path(path)
+    top_level is None when *path* is not in a work tree.
+    """
+    if not os.path.exists(path):
+        return None
 
+    # rev-parse prints the answers in order and only stops at --show-toplevel outside of a work tree,
+    # so one call answers all questions
+    proc = subprocess.run(
+        ['git', '-C', path, 'rev-parse', '--is-bare-repository', '--git-dir', '--show-toplevel'],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    lines = proc.stdout.decode().splitlines()
+    if len(lines) < 2:
+        return None
+    return lines[0] == 'true', lines[1], lines[2] if proc.returncode == 0 and len(lines) > 2 else None
 
-def is_bare_git_repo(path):
-    if not os.path.exists(path):
-        return False
 
-    cmd = f'git -C {path} rev-parse --is-bare-repository'
-    try:
-        output = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError:
-        return False
-    return output.decode().strip() == 'true'
+def is_git_root(path):
+    probe = _git_probe(path)
+    return bool(probe and probe[2]) and Path(probe[2]) == Path(path)
+
+
+def is_bare_git_repo(path):
+    probe = _git_probe(path)
+    return bool(probe and probe[0])
 
 
 def is_git_repo(path):
-    if not os.path.exists(path):
-        return False
-    cmd = f'git -C {path} rev-parse'
-    try:
-        check_output(cmd, shell=True, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError:
-        return False
-    else:
-        return True
+    return _git_probe(path) is not None
 
 
 def git_root_dir(path=None):
-    command = ['git', 'rev-parse', '--show-toplevel']
-    p = subprocess.Popen(' '.join(command),
-                         stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE,
-                         shell=True, cwd=path)
-    result, error = p.communicate()
-    if p.returncode and error:
+    p = subprocess.run(
+        ['git', 'rev-parse', '--show-toplevel'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=path
+    )
+    if p.returncode and p.stderr:
         raise HabitatException(
             'Error, can not get git root in path %s, '
-            'make sure it is a git repo: %s' % (error.decode('utf-8'), path)
+            'make sure it is a git repo: %s' % (path, p.stderr.decode('utf-8'))
         )
-    return Path(result.decode('utf-8').strip())
+    return Path(p.stdout.decode('utf-8').strip())
 
 
 def find_classes(module, is_target=None, handle_error=None, recursive=True):
@@ -391,14 +608,14 @@ def find_classes(module, is_target=None, handle_error=None, recursive=True):
     submodules = []
     if not inspect.ismodule(module):
         return classes
-    for info, name, is_pkg in pkgutil.iter_modules(module.__path__):
+    for _, name, is_pkg in pkgutil.iter_modules(module.__path__):
         full_name = module.__name__ + '.' + name
         mod = sys.modules.get(full_name)
         if not mod:
             try:
-                mod = info.find_module(full_name).load_module(full_name)
-            except AttributeError:
-                mod = info.find_spec(full_name).loader.load_module(full_name)
+                # the regular import machinery takes the per-module import lock and reuses cached bytecode,
+                # unlike the deprecated loader.load_module
+                mod = importlib.import_module(full_name)
             except Exception as e:
                 logging.debug(format_exception(e))
                 if handle_error:
@@ -409,15 +626,12 @@ def find_classes(module, is_target=None, handle_error=None, recursive=True):
         if is_pkg and recursive:
             submodules.append(mod)
         else:
-            classes = classes.union(
-                [
-                    c[1]
-                    for c in inspect.getmembers(mod, inspect.isclass)
-                    if ((is_target is None or is_target(c[1])) and c[1].__module__ == mod.__name__)
-                ]
+            classes.update(
+                c for _, c in inspect.getmembers(mod, inspect.isclass)
+                if (is_target is None or is_target(c)) and c.__module__ == mod.__name__
             )
     for m in submodules:
-        classes = classes.union(find_classes(m, is_target=is_target, handle_error=handle_error, recursive=recursive))
+        classes.update(find_classes(m, is_target=is_target, handle_error=handle_error, recursive=recursive))
     return classes
 
 
@@ -428,32 +642,53 @@ def create_temp_dir(root_dir=os.getcwd(), name=None):
 
 
 def clean_temp_dirs(root_dir=os.getcwd(), name=None):
-    for path in Path(root_dir).glob(f'{CACHE_DIR_PREFIX}{name + "-" if name else ""}*'):
+    prefix = f'{CACHE_DIR_PREFIX}{name + "-" if name else ""}'
+    try:
+        with os.scandir(root_dir) as it:
+            paths = [e.path for e in it if e.name.startswith(prefix) and e.is_dir(follow_symlinks=False)]
+    except FileNotFoundError:
+        return
+    for path in paths:
         shutil.rmtree(path, ignore_errors=True)
 
 
 class Singleton(type):
     _instances = {}
+    # reentrant, the constructor of a singleton may create another singleton
+    _lock = threading.RLock()
 
     def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
-        return cls._instances[cls]
+        instance = cls._instances.get(cls)
+        if instance is None:
+            with cls._lock:
+                # another thread may have created the instance while this one was waiting for the lock
+                instance = cls._instances.get(cls)
+                if instance is None:
+                    instance = cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
+        return instance
 
 
 class ProgressBar:
 
+    # minimum number of seconds between two redraws, the final state is always drawn
+    min_interval = 0.05
+
     def __init__(self, total=100, title=""):
         self.total = total
         self.title = title
         self.current = 0
+        self._last_draw = None
         self.update(0)
 
     def update(self, n=1):
         self.current += n
+        now = time.monotonic()
+        if self.current != self.total and self._last_draw is not None and now - self._last_draw < self.min_interval:
+            return
+        self._last_draw = now
         percent = '{:.2%}'.format(self.current / self.total)
         sys.stdout.write('\r')
-        sys.stdout.write('%s[%-50s] %s' % (self.title, '=' * int(math.floor(self.current * 50 / self.total)), percent))
+        sys.stdout.write('%s[%-50s] %s' % (self.title, '=' * int(self.current * 50 // self.total), percent))
         sys.stdout.flush()
         if self.current == self.total:
             sys.stdout.write('\n')
@@ -470,15 +705,13 @@ async def set_git_alternates(source_dir, objects_dir):
 async def clear_git_alternates(source_dir):
     alternates_file = os.path.join(source_dir, '.git', 'objects', 'info', 'alternates')
     if os.path.exists(alternates_file):
-        cmd = 'git repack -a -d -q'
-        await async_check_call(cmd, shell=True, cwd=source_dir)
+        await async_check_call(['git', 'repack', '-a', '-d', '-q'], cwd=source_dir)
         os.remove(alternates_file)
 
 
 def is_git_repo_valid(source_dir):
     try:
-        cmd = 'git status'
-        check_output(cmd, shell=True, cwd=source_dir, stderr=subprocess.STDOUT)
+        check_output(['git', 'status'], cwd=source_dir, stderr=subprocess.STDOUT)
     except subprocess.CalledProcessError:
         return False
 
@@ -495,42 +728,162 @@ def is_git_repo_valid(source_dir):
     return True
 
 
+@functools.lru_cache(maxsize=128)
+def _compile_file(path, mtime_ns, size):
+    with open(path, 'rb') as f:
+        return compile(f.read(), path, 'exec')
+
+
+def load_code(path):
+    """
+    Return the compiled code object of a python file, it is cached by the path, mtime and size of the file so that the
+    same file evaluated multiple times (e.g. once per target) is only compiled once.
+    """
+    st = os.stat(path)
+    return _compile_file(os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+
+def code_references(code, names) -> bool:
+    """return True if the code object, including nested functions and comprehensions, loads any of the names."""
+    if not names.isdisjoint(code.co_names):
+        return True
+    return any(inspect.iscode(c) and code_references(c, names) for c in code.co_consts)
+
+
 def eval_deps(deps_file, target, root_dir):
     env = {"target": target, "root_dir": root_dir}
     if hasattr(deps_file, 'read'):
         exec(deps_file.read(), env)
     else:
-        with open(deps_file, 'rb') as f:
-            exec(f.read(), env)
+        exec(load_code(deps_file), env)
 
     if 'deps' not in env:
         raise HabitatException(f'Can not find deps in file {deps_file}')
     return env["deps"]
 
 
+# sendfile only writes to regular files on linux
+_SENDFILE_TO_FILE = sys.platform.startswith('linux') and hasattr(os, 'sendfile')
+_ZIP_LOCAL_HEADER = struct.Struct('<4s22xHH')
+
+
+def _can_sendfile(z_info):
+    # members whose names extract would sanitize are left to it
+    name = z_info.filename
+    return (
+        _SENDFILE_TO_FILE and z_info.compress_type == ZIP_STORED and not z_info.flag_bits & 0x1 and
+        not z_info.is_dir() and not name.startswith('/') and '..' not in name.split('/') and '\\' not in name
+    )
+
+
+def _sendfile_member(src_fd: int, z_info, dst: str):
+    """
+    Copies a stored member from the archive to its file in dst inside the kernel and checks its CRC-32 like
+    ZipFile.read does, returns the file path.
+    """
+    signature, name_length, extra_length = _ZIP_LOCAL_HEADER.unpack(
+        os.pread(src_fd, _ZIP_LOCAL_HEADER.size, z_info.header_offset)
+    )
+    if signature != b'PK\x03\x04':
+        raise BadZipFile(f'bad local file header of {z_info.filename}')
+    offset = z_info.header_offset + _ZIP_LOCAL_HEADER.size + name_length + extra_length
+
+    file_path = os.path.join(dst, *z_info.filename.split('/'))
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'w+b') as f:
+        remaining = z_info.file_size
+        while remaining:
+            sent = os.sendfile(f.fileno(), src_fd, offset, remaining)
+            if not sent:
+                raise BadZipFile(f'truncated member {z_info.filename}')
+            offset += sent
+            remaining -= sent
+
+        # the written file is still in the page cache, reading it back is cheap
+        crc = 0
+        position = 0
+        while position < z_info.file_size:
+            block = os.pread(f.fileno(), min(1024 * 1024, z_info.file_size - position), position)
+            if not block:
+                break
+            crc = zlib.crc32(block, crc)
+            position += len(block)
+    if crc != z_info.CRC:
+        raise BadZipFile(f'Bad CRC-32 for file {z_info.filename!r}')
+    return file_path
+
+
+def _extract_zip_members(src: str, dst: str, members: list):
+    # every worker reads through its own handle, the file position of a ZipFile is shared by its readers
+    with ZipFile(src, 'r') as z, open(src, 'rb') as raw:
+        for z_info in members:
+            if _can_sendfile(z_info):
+                # stored members need no decompression, their bytes never have to pass through python
+                file_path = _sendfile_member(raw.fileno(), z_info, dst)
+            else:
+                try:
+                    file_path = z.extract(z_info, dst)
+                except FileExistsError:
+                    # another worker created the same parent directory in between, it exists now
+                    file_path = z.extract(z_info, dst)
+            os.chmod(file_path, z_info.external_attr >> 16)
+
+
 def extract_zipfile(src: str, dst: str, paths: list):
-    z = ZipFile(src, 'r')
-    paths = [p.rstrip('/') for p in paths]
-    for z_info in z.infolist():
-        file, mode = z_info.filename, z_info.external_attr >> 16
-        if paths and not match_paths(file, paths):
-            continue
-        else:
-            file_path = os.path.join(dst, file)
-            if stat.S_ISLNK(mode):
-                target = Path(z.read(file).decode())
-                symlink = Path(file_path)
-                symlink.symlink_to(target)
+    match = _path_matcher(paths) if paths else None
+    members, symlinks = [], []
+    with ZipFile(src, 'r') as z:
+        for z_info in z.infolist():
+            if match and not match(z_info.filename):
+                continue
+            if stat.S_ISLNK(z_info.external_attr >> 16):
+                symlinks.append(z_info)
             else:
-                z.extract(file, dst)
-                os.chmod(file_path, mode)
+                members.append(z_info)
+
+        # zlib releases the GIL while inflating, so members are decompressed by several threads, the largest
+        # members are dealt out first to balance the work
+        workers = min(os.cpu_count() or 1, len(members))
+        if workers > 1:
+            members.sort(key=lambda i: i.compress_size, reverse=True)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_extract_zip_members, src, dst, members[i::workers]) for i in range(workers)]
+                for future in as_completed(futures):
+                    future.result()
+        else:
+            _extract_zip_members(src, dst, members)
+
+        # symlinks are created last, their parent directories exist by then
+        for z_info in symlinks:
+            Path(os.path.join(dst, z_info.filename)).symlink_to(Path(z.read(z_info).decode()))
 
 
 def extract_tarfile(src: str, dst: str, paths: list):
     if not os.path.exists(dst):
         os.makedirs(dst)
     tar = 'tar.exe' if platform.system().lower() == 'windows' else 'tar'
-    subprocess.run(f"{tar} -xpf {src} -C {dst} {' '.join(paths)}", shell=True)
+    # run tar directly, paths with spaces or shell metacharacters are passed through unchanged
+    returncode = subprocess.run([tar, '-xpf', src, '-C', dst] + paths).returncode
+    if returncode != 0:
+        raise HabitatException(f'failed to extract {src}, tar exited with {returncode}')
+
+
+# tar can't detect the compression of an archive read from a pipe
+TAR_COMPRESSION_FLAGS = {
+    '.bz2': ['-j'], '.tbz2': ['-j'], '.gz': ['-z'], '.tgz': ['-z'], '.xz': ['-J'], '.txz': ['-J'], '.tar': []
+}
+
+
+async def open_tarfile_extraction(name: str, dst: str, paths: list):
+    """
+    start a tar process extracting the archive written to its stdin to dst, the compression is given by the
+    extension of the archive name. raises NotImplementedError if the event loop can not run subprocesses.
+    """
+    if not os.path.exists(dst):
+        os.makedirs(dst)
+    tar = 'tar.exe' if platform.system().lower() == 'windows' else 'tar'
+    flags = TAR_COMPRESSION_FLAGS[os.path.splitext(name)[1]]
+    return await asyncio.create_subprocess_exec(tar, '-xp', *flags, '-f', '-', '-C', dst, *paths, stdin=subprocess.PIPE)
 
 
 UNPACK_FORMAT_EXTENSIONS = {
@@ -544,13 +897,17 @@ UNPACK_FORMAT_EXTRACTION = {
 }
 
 
-def extract_archive(src: str, dst: str, paths: list):
+def get_archive_format(src: str):
     _, ext = os.path.splitext(src)
     archive_format = None
     for fmt, extensions in UNPACK_FORMAT_EXTENSIONS.items():
         if ext in extensions:
             archive_format = fmt
+    return archive_format
 
+
+def extract_archive(src: str, dst: str, paths: list):
+    archive_format = get_archive_format(src)
     if not archive_format:
         raise HabitatException(f'file {src} is not a supported archive format.')
 
@@ -560,10 +917,14 @@ def extract_archive(src: str, dst: str, paths: list):
 
 
 def print_all_exception(e: BaseException):
-    upper_exception = e.__cause__ or e.__context__
-    logging.error(f'{type(e).__name__}: {e}')
-    if upper_exception:
-        print_all_exception(upper_exception)
+    # walk the chain of causes iteratively and log it as one record, a chain can be longer than the recursion limit
+    lines = []
+    seen = set()
+    while e is not None and id(e) not in seen:
+        seen.add(id(e))
+        lines.append(f'{type(e).__name__}: {e}')
+        e = e.__cause__ or e.__context__
+    logging.error('\n'.join(lines))
 
 
 def literally_replace(content: str, config):
@@ -572,20 +933,22 @@ def literally_replace(content: str, config):
     return content
 
 
-async def is_git_user_set() -> bool:
+@functools.lru_cache(maxsize=1)
+def _is_git_user_set() -> bool:
     try:
-        await async_check_output(
-            shlex.split('git config user.name'), stderr=subprocess.STDOUT
-        )
-        await async_check_output(
-            shlex.split('git config user.email'), stderr=subprocess.STDOUT
-        )
+        check_output(['git', 'config', 'user.name'], stderr=subprocess.STDOUT)
+        check_output(['git', 'config', 'user.email'], stderr=subprocess.STDOUT)
     except subprocess.CalledProcessError:
         return False
 
     return True
 
 
+async def is_git_user_set() -> bool:
+    # the user is read from the global configuration, it doesn't change during a run
+    return await to_thread(_is_git_user_set)
+
+
 class DependencyGraph:
     def __init__(self, deps: dict) -> None:
         self.node_requirements = defaultdict(list)
@@ -22,6 +22,7 @@ DEV_REQUIRES = [
     'isort>=4.0.0,<5.0.0',
     'pytest>=4.0.0,<5.0.0',
     'pytest_httpserver==1.0.12',
+    'pytest-xdist>=1.28.0,<2.0.0',
     'pex'
 ] + REQUIRES
 
@@ -61,6 +62,7 @@ setup(
     python_requires='>=3.5',
     extras_require={
         'dev': DEV_REQUIRES,
+        'uvloop': ['uvloop>=0.17.0; platform_system != "Windows"'],
     },
     entry_points={
         'console_scripts': [
@@ -1,21 +1,61 @@
+import atexit
 import os
 import shlex
+import shutil
 import subprocess
+import tempfile
 
 import pytest
 
-from utils import create_test_binary_resource, generate_habitat_config_file, make_change_in_repo
+from utils import create_test_binary_resource, generate_habitat_config_file, init_git_repo, make_change_in_repo
 
 pytest_plugins = ("pytest_httpserver",)
 
+# every session, and so every xdist worker, gets its own global cache, the tests neither touch the user's cache nor
+# race on a shared one, test_clean wipes it; set before the test modules import core.settings
+os.environ['HABITAT_CACHE_DIR'] = tempfile.mkdtemp(prefix='habitat-cache-')
+atexit.register(shutil.rmtree, os.environ['HABITAT_CACHE_DIR'], ignore_errors=True)
+
+# settings for every git process of the session, the test repositories are disposable and never need gc or fsync
+GIT_TEST_CONFIG = {
+    'gc.auto': '0',
+    'core.fsync': 'none',
+    'commit.gpgsign': 'false',
+    'advice.detachedHead': 'false',
+}
+
+
+@pytest.fixture(autouse=True, scope='session')
+def git_test_environment():
+    """
+    The fixture passes GIT_TEST_CONFIG to all git processes through GIT_CONFIG_COUNT/KEY/VALUE and disables prompts.
+    """
+    count = int(os.environ.get('GIT_CONFIG_COUNT', '0'))
+    environment = {'GIT_CONFIG_COUNT': str(count + len(GIT_TEST_CONFIG)), 'GIT_TERMINAL_PROMPT': '0'}
+    for i, (key, value) in enumerate(GIT_TEST_CONFIG.items(), start=count):
+        environment[f'GIT_CONFIG_KEY_{i}'] = key
+        environment[f'GIT_CONFIG_VALUE_{i}'] = value
+
+    # pytest.MonkeyPatch is not public before pytest 6.2, save and restore the variables by hand
+    saved = {name: os.environ.get(name) for name in environment}
+    os.environ.update(environment)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
 
 @pytest.fixture(name='default_repo')
 def fixture_default_repo(tmp_path):
     """
     The fixture includes a main repo with two dependencies: a git dependency and an action dependency.
     """
-    subprocess.run(shlex.split('git init main --initial-branch=master'), cwd=tmp_path, check=True)
-    subprocess.run(shlex.split('git init git-dependency --initial-branch=master'), cwd=tmp_path, check=True)
+    init_git_repo(os.path.join(tmp_path, 'main'))
+    init_git_repo(os.path.join(tmp_path, 'git-dependency'))
 
     make_change_in_repo(
         os.path.join(tmp_path, 'git-dependency'),
@@ -77,7 +117,7 @@ def fixture_lfs_repo(default_repo):
     remote_path = os.path.join(temp_path, 'remote')
     os.makedirs(remote_path, exist_ok=True)
 
-    subprocess.run(shlex.split('git init lfs --initial-branch=master'), cwd=remote_path, check=True)
+    init_git_repo(os.path.join(remote_path, 'lfs'))
 
     # we use temp_path/remote/lfs as a lfs server, use temp_path/lfs to push binary file to lfs server.
     subprocess.run(shlex.split(f'git clone file://{remote_path}/lfs/.git'), cwd=temp_path, check=True)
@@ -110,3 +150,23 @@ def fixture_lfs_repo(default_repo):
     )
 
     return default_repo, sha256
+
+
+@pytest.fixture(name='archives', scope='session')
+def fixture_archives(tmp_path_factory):
+    """
+    The fixture archives a file with mode 777 and a directory with mode 711 once per session in every format
+    supported by extract_archive, returns the archive paths keyed by format and the modes of the file and directory.
+    """
+    content_path = tmp_path_factory.mktemp('archive-content')
+    with open(test_file := f'{content_path}/test-file', 'w') as f:
+        f.write('test')
+    os.chmod(test_file, mode=0o777)
+    os.makedirs(test_dir := f'{content_path}/test-dir', mode=0o711)
+
+    archive_path = tmp_path_factory.mktemp('archives')
+    archives = {
+        archive_format: shutil.make_archive(f'{archive_path}/archive', archive_format, root_dir=content_path)
+        for archive_format in ['gztar', 'zip', 'xztar', 'bztar', 'tar']
+    }
+    return archives, os.stat(test_file).st_mode, os.stat(test_dir).st_mode
@@ -0,0 +1,32 @@
+import os
+
+from core.components.action_dependency import call_function
+
+
+def test_call_function_with_kwargs_changes_directory(tmp_path):
+    saved_dir = os.getcwd()
+
+    def action(**kwargs):
+        # legacy functions rely on relative paths
+        assert 'cwd' not in kwargs
+        with open('action.txt', 'w') as f:
+            f.write('test')
+
+    call_function(action, str(tmp_path))
+
+    assert (tmp_path / 'action.txt').read_text() == 'test'
+    assert os.getcwd() == saved_dir
+
+
+def test_call_function_with_cwd(tmp_path):
+    saved_dir = os.getcwd()
+    called_cwd = []
+
+    def action(cwd):
+        called_cwd.append(cwd)
+        # the working directory is not changed for functions taking cwd
+        assert os.getcwd() == saved_dir
+
+    call_function(action, str(tmp_path))
+
+    assert called_cwd == [str(tmp_path)]
@@ -0,0 +1,27 @@
+import os
+
+from core.common.cache_mixin import CacheMixin
+
+
+def test_put_to_cache_replaces_dangling_symlink(tmp_path):
+    cache = CacheMixin()
+    cache.cache_dir = str(tmp_path / 'objects')
+    cache_path = tmp_path / 'objects' / 'host' / 'file'
+    cache_path.parent.mkdir(parents=True)
+    cache_path.symlink_to(tmp_path / 'missing')
+
+    assert cache.get_from_cache('host/file') is None
+    cache.put_to_cache('host/file', content=b'test')
+
+    assert not os.path.islink(cache_path)
+    assert cache.get_from_cache('host/file') == str(cache_path)
+    assert cache_path.read_bytes() == b'test'
+
+
+def test_put_to_cache_keeps_existing_entry(tmp_path):
+    cache = CacheMixin()
+    cache.cache_dir = str(tmp_path / 'objects')
+    cache.put_to_cache('host/file', content=b'test')
+    cache.put_to_cache('host/file', content=b'other')
+
+    assert (tmp_path / 'objects' / 'host' / 'file').read_bytes() == b'test'
@@ -1,9 +1,8 @@
 import os
-import shlex
 import subprocess
 
 from core.main import main
-from utils import run_with_custom_argv
+from utils import init_git_repo, run_with_custom_argv
 
 
 def test_config_with_branch(tmp_path, default_repo):
@@ -16,8 +15,8 @@ def test_config_with_branch(tmp_path, default_repo):
         test_config_repo (solutions url should point to main repo)
          └── git-dependency
     """
-    subprocess.run(shlex.split('git init test-config --initial-branch=master'), cwd=tmp_path, check=True)
     test_config_repo_path = os.path.join(tmp_path, 'test-config')
+    init_git_repo(test_config_repo_path)
 
     branch = 'master'
     run_with_custom_argv(main, [
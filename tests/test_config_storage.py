@@ -0,0 +1,17 @@
+from core.config_storage import ConfigStorage
+
+
+def test_iterate_config_storage(tmp_path, monkeypatch):
+    storage = ConfigStorage(str(tmp_path / 'config'))
+    storage.set_many({'git.auth': 'stored', 'other': 'stored'})
+    monkeypatch.setenv('HABITAT_GIT_AUTH', 'env')
+    monkeypatch.setenv('HABITAT_NEW_KEY', 'env')
+
+    items = list(storage)
+
+    # environment variables override stored configurations and come after them otherwise
+    assert items[:2] == [('git.auth', 'env'), ('other', 'stored')]
+    assert ('new.key', 'env') in items[2:]
+    # iterating never copies the environment into the stored data
+    assert storage.data == {'git.auth': 'stored', 'other': 'stored'}
+    assert ConfigStorage(str(tmp_path / 'config')).data == {'git.auth': 'stored', 'other': 'stored'}
@@ -0,0 +1,149 @@
+import asyncio
+import random
+from argparse import ArgumentParser, Namespace
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from core.commands.sync import Sync
+from core.components.dependency_group import DependencyGroup, fetch_child, get_final_components_to_fetch
+from core.event_manager import ThreadingEventManager
+from core.exceptions import HabitatException
+from core.main import load_commands
+from core.settings import MAX_FETCH_CONCURRENCY
+
+
+def _recursive_filter(components_to_fetch):
+    # the filter before the worklist, skips components with a skipped requirement until nothing changes
+    has_new_skipped_component = False
+    for name in list(components_to_fetch.keys()):
+        require = getattr(components_to_fetch[name], 'require', [])
+        if set(require) - set(components_to_fetch.keys()):
+            has_new_skipped_component = True
+            components_to_fetch.pop(name, None)
+    if has_new_skipped_component:
+        _recursive_filter(components_to_fetch)
+
+
+def test_get_final_components_to_fetch():
+    components = {
+        'a': SimpleNamespace(require=['b']),
+        'b': SimpleNamespace(require=['missing']),
+        'c': SimpleNamespace(require=['d']),
+        'd': SimpleNamespace(),
+    }
+    get_final_components_to_fetch(components)
+    assert list(components) == ['c', 'd']
+
+
+def test_get_final_components_to_fetch_matches_recursive_filter():
+    rng = random.Random(0)
+    for _ in range(200):
+        names = [f'dep{i}' for i in range(rng.randint(1, 20))]
+        candidates = names + ['missing1', 'missing2']
+        components = {
+            name: SimpleNamespace(require=rng.sample(candidates, rng.randint(0, 3))) for name in names
+        }
+        expected = dict(components)
+        _recursive_filter(expected)
+        get_final_components_to_fetch(components)
+        assert list(components) == list(expected)
+
+
+class FakeChild:
+    def __init__(self, name, fetch, require=()):
+        self.name = name
+        self.condition = True
+        self.source = name
+        self.source_stamp = name
+        self.target_dir = f'/deps/{name}'
+        self.require = list(require)
+        self.parent = None
+        self._fetch = fetch
+
+    async def fetch(self, *args, **kwargs):
+        await self._fetch(self)
+
+
+def _fetch_children(children, jobs):
+    group = SimpleNamespace(_children=children, _event_manager=ThreadingEventManager())
+    return DependencyGroup.fetch_children(group, '/', Namespace(jobs=jobs, strict=False))
+
+
+@pytest.mark.parametrize('jobs', [1, 2, 4])
+def test_fetch_children_jobs_bound_concurrency(jobs):
+    running = []
+    max_running = []
+
+    async def fetch(child):
+        running.append(child.name)
+        max_running.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(child.name)
+
+    asyncio.run(_fetch_children([FakeChild(f'dep{i}', fetch) for i in range(8)], jobs))
+    assert max(max_running) == jobs
+
+
+def test_failed_fetch_cancels_siblings():
+    fetched = []
+    cancelled = []
+
+    async def fail(child):
+        raise RuntimeError('failed')
+
+    async def slow(child):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(child.name)
+            raise
+
+    async def record(child):
+        fetched.append(child.name)
+
+    children = [
+        FakeChild('slow', slow), FakeChild('failing', fail), FakeChild('waiting', record, require=['slow'])
+    ]
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await _fetch_children(children, 4)
+        # let the cancelled siblings unwind
+        await asyncio.sleep(0.1)
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+    assert cancelled == ['slow']
+    assert fetched == []
+
+
+def test_sync_jobs_option():
+    parser = ArgumentParser('hab')
+    load_commands(parser, [Sync])
+    assert parser.parse_args(['sync', '-j', '3']).jobs == 3
+    assert parser.parse_args(['sync']).jobs == MAX_FETCH_CONCURRENCY
+    for jobs in ['0', '-1', 'x']:
+        with pytest.raises(SystemExit):
+            parser.parse_args(['sync', '-j', jobs])
+
+
+def test_fetch_child_timeout_lists_pending_events():
+    fetched = []
+
+    async def record(child):
+        fetched.append(child.name)
+
+    async def run():
+        manager = ThreadingEventManager()
+        manager.produce_event('produced')
+        events = [manager.register_consumer('produced'), manager.register_consumer('pending')]
+        with patch('core.components.dependency_group.MAX_DEPENDENCY_WAIT_TIME', 0.05):
+            with pytest.raises(HabitatException) as e:
+                await fetch_child(FakeChild('child', record), events=events)
+        return str(e.value)
+
+    message = asyncio.run(run())
+    assert 'event: pending' in message
+    assert 'event: produced' not in message
+    assert fetched == []
@@ -0,0 +1,16 @@
+import pytest
+
+from core.commands.deps import PartialFormatter
+
+
+@pytest.mark.parametrize('format_string, expected', [
+    ('{name}@{commit}', 'abc@~'),
+    ('{name:>{width}}', '       abc'),
+    ('{name!r:{fill}<{width}}', "'abc'-----"),
+])
+def test_partial_formatter_format_parsed(format_string, expected):
+    formatter = PartialFormatter()
+    attributes = {'name': 'abc', 'width': 10, 'fill': '-'}
+    assert formatter.format_parsed(list(formatter.parse(format_string)), attributes) == expected
+    # formatting a parsed template is equivalent to vformat
+    assert formatter.vformat(format_string, (), attributes) == expected
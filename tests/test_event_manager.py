@@ -0,0 +1,23 @@
+import asyncio
+
+from core.event_manager import ThreadingEventManager
+
+
+def test_event_manager_remembers_produced_events():
+    async def run():
+        manager = ThreadingEventManager()
+        # a consumer registered after the event was produced does not wait for it again
+        manager.produce_event('produced')
+        assert manager.register_consumer('produced').is_set()
+
+        event = manager.register_consumer('pending')
+        assert not event.is_set()
+        manager.produce_event('pending')
+        assert event.is_set()
+
+        # clearing releases the consumers still waiting
+        event = manager.register_consumer('never')
+        manager.clear()
+        assert event.is_set()
+
+    asyncio.run(run())
@@ -4,20 +4,19 @@ import subprocess
 from argparse import Namespace
 
 from core.components.git_dependency import GitDependency
+from utils import init_git_repo
 
 
 def test_fetch_by_tag(tmp_path):
     # Prepare local git repository
-    os.chdir(tmp_path)
-    subprocess.check_call(['git', 'init', 'git'])
-    os.chdir('git')
-    with open('test', 'w') as f:
+    repo_dir = os.path.join(tmp_path, 'git')
+    init_git_repo(repo_dir)
+    with open(os.path.join(repo_dir, 'test'), 'w') as f:
         f.write('test')
-    subprocess.check_call(['git', 'add', '.'])
-    subprocess.check_call(['git', 'commit', '-m', 'test'])
-    subprocess.check_call(['git', 'tag', 'v0.0.1'])
+    subprocess.check_call(['git', 'add', '.'], cwd=repo_dir)
+    subprocess.check_call(['git', 'commit', '-m', 'test'], cwd=repo_dir)
+    subprocess.check_call(['git', 'tag', 'v0.0.1'], cwd=repo_dir)
 
-    os.chdir('../..')
     dep = GitDependency(os.path.join(tmp_path, 'target_repo'), {
         "name": "target_repo",
         "type": "git",
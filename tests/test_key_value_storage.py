@@ -0,0 +1,43 @@
+import json
+import os
+from unittest.mock import patch
+
+import pytest
+
+from core.common.key_value_storage import KeyValueStorage, NotSet
+
+
+def test_set_many_persists_all_keys(tmp_path):
+    storage = KeyValueStorage(str(tmp_path / 'meta' / 'storage'))
+    storage.set('a', 1)
+    storage.set_many({'a': 1, 'b': 2, 'c': {'d': 3}})
+
+    reloaded = KeyValueStorage(str(tmp_path / 'meta' / 'storage'))
+    assert reloaded.data == {'a': 1, 'b': 2, 'c': {'d': 3}}
+    assert reloaded.get('missing') is NotSet
+
+
+def test_set_many_skips_unchanged_items(tmp_path):
+    storage = KeyValueStorage(str(tmp_path / 'storage'))
+    storage.set_many({'a': 1, 'b': 2})
+    with patch.object(storage, '_dump') as dump:
+        storage.set_many({'a': 1, 'b': 2})
+    dump.assert_not_called()
+
+
+def test_interrupted_write_keeps_old_file(tmp_path):
+    file_path = tmp_path / 'storage'
+    storage = KeyValueStorage(str(file_path))
+    storage.set_many({'a': 1})
+
+    def interrupted_dump(data, f):
+        f.write('{"a": 1, "b"')
+        raise KeyboardInterrupt
+
+    with patch('core.common.key_value_storage.json.dump', side_effect=interrupted_dump):
+        with pytest.raises(KeyboardInterrupt):
+            storage.set_many({'b': 2})
+
+    assert json.loads(file_path.read_text()) == {'a': 1}
+    # the half-written temporary file is removed
+    assert os.listdir(tmp_path) == ['storage']
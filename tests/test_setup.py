@@ -0,0 +1,44 @@
+import pytest
+
+from core.commands.setup import parse_config_expression
+from core.exceptions import HabitatException
+
+
+@pytest.mark.parametrize('expression, expected', [
+    ('a=1', {'a': '1'}),
+    ('a=1,b=2', {'a': '1', 'b': '2'}),
+    # a key ends at the first "="
+    ('a=b=c', {'a': 'b=c'}),
+    ('url=https://host/path?x=1', {'url': 'https://host/path?x=1'}),
+    # whitespace around items is ignored, inside values it is kept
+    ('a=1, b=2', {'a': '1', 'b': '2'}),
+    (' a=1 ,b=2 ', {'a': '1', 'b': '2'}),
+    ('a=x y', {'a': 'x y'}),
+    # quotes have no special meaning
+    ('a="x y"', {'a': '"x y"'}),
+    ("a='x'", {'a': "'x'"}),
+    ('a=', {'a': ''}),
+    ('a=1,a=2', {'a': '2'}),
+    ('a=äb', {'a': 'b'}),
+])
+def test_parse_config_expression(expression, expected):
+    assert parse_config_expression(expression) == expected
+
+
+@pytest.mark.parametrize('expression', [
+    'a', '=1', 'a b=1', 'a =1', 'a=1,,b=2', 'a=1,', 'a="x,y"', 'a=1,b',
+])
+def test_parse_invalid_config_expression(expression):
+    with pytest.raises(HabitatException):
+        parse_config_expression(expression)
+
+
+@pytest.mark.parametrize('expression, unexpected', [
+    ('a=b,,c=d', "',c=d' at position 4"),
+    ('a=1,', "',' at position 3"),
+    ('a=1,b', "'b' at position 4"),
+])
+def test_parse_invalid_config_expression_message(expression, unexpected):
+    with pytest.raises(HabitatException) as e:
+        parse_config_expression(expression)
+    assert str(e.value) == f'Invalid expression {expression!r}, unexpected {unexpected}'
@@ -0,0 +1,50 @@
+import io
+import json
+from unittest.mock import patch
+
+from core.components.solution import eval_solutions, merge_deps
+
+SOLUTIONS = [{'name': '.', 'deps_file': 'DEPS', 'url': 'file:///repo/.git', 'branch': 'master', 'managed': True}]
+
+
+def test_eval_solutions_json():
+    content = f'solutions = {json.dumps(SOLUTIONS, indent=2)}\n'
+    # the json document is loaded without running the file
+    with patch('core.components.solution.exec', create=True, side_effect=AssertionError):
+        assert eval_solutions(io.StringIO(content)) == {'solutions': SOLUTIONS}
+
+
+def test_eval_solutions_fallback_to_exec(tmp_path):
+    # python literals are not json, the file is executed instead
+    solution_file = tmp_path / '.habitat'
+    solution_file.write_text(f'solutions = {SOLUTIONS!r}')
+    assert eval_solutions(str(solution_file)) == {'solutions': SOLUTIONS}
+
+    # so is a file with more than the solutions assignment
+    content = f'habitat_version = "1.0.0"\nsolutions = {SOLUTIONS!r}\nunused = 1\n'
+    assert eval_solutions(io.StringIO(content)) == {'habitat_version': '1.0.0', 'solutions': SOLUTIONS}
+
+
+def test_merge_deps():
+    base = {
+        'a': {'type': 'git', 'url': 'a', 'condition': False},
+        'b': {'type': 'git', 'url': 'b'},
+        'c': {'type': 'git', 'url': 'c', 'condition': True},
+    }
+    new = {
+        'a': {'branch': 'main', 'condition': True},
+        'c': {'condition': False},
+        'd': {'type': 'action'},
+        'b': None,
+    }
+    assert merge_deps(base, new) == {
+        # a condition in either deps keeps the dependency
+        'a': {'type': 'git', 'url': 'a', 'condition': True, 'branch': 'main'},
+        # an empty value in new replaces the one in base
+        'b': None,
+        'c': {'type': 'git', 'url': 'c', 'condition': True},
+        'd': {'type': 'action'},
+    }
+    # keys follow the order of the deps files
+    assert list(merge_deps(base, new)) == ['a', 'b', 'c', 'd']
+    assert merge_deps(base, {}) is base
@@ -1,14 +1,17 @@
-import hashlib
+import asyncio
 import json
 import os.path
 import subprocess
+from types import SimpleNamespace
 from unittest.mock import patch
 
+from core.commands.sync import group_by_nesting_level
 from core.components.solution import load_entries_cache_from_git, store_entries_cache_to_git
 from core.exceptions import HabitatException
 from core.main import main
-from core.utils import rmtree
-from utils import create_zip_file, generate_habitat_config_file, make_change_in_repo, run_with_custom_argv
+from core.utils import file_hexdigest
+from utils import (create_zip_file, generate_habitat_config_file, init_git_repo, make_change_in_repo,
+                   make_changes_in_repo, prepare_repo, run_with_custom_argv)
 
 
 def test_sync_local_cache(default_repo):
@@ -26,7 +29,6 @@ def test_sync_disable_cache(default_repo):
 
 
 def test_store_and_load_entries_cache(default_repo):
-    os.chdir(default_repo)
     test_entries = {
         "entries": {
             ".": "git@host.example.com:namespace/monorepo.git@",
@@ -37,13 +39,13 @@ def test_store_and_load_entries_cache(default_repo):
         "hash": "e827dc0158379e88168b286792443103"
     }
 
-    store_entries_cache_to_git(test_entries)
-    entries = load_entries_cache_from_git()
+    store_entries_cache_to_git(test_entries, root_dir=default_repo)
+    entries = load_entries_cache_from_git(root_dir=default_repo)
 
     assert test_entries == entries
 
 
-def test_sync_recursively_duplicated_source():
+def test_sync_recursively_duplicated_source(tmp_path):
     """
     Independent repositories:
         main(git 1)
@@ -61,18 +63,11 @@ def test_sync_recursively_duplicated_source():
          └── sub2(git 2 revision 1)
     """
 
-    temp_dir = test_sync_recursively_duplicated_source.__name__
-    cwd = os.path.join(os.getcwd(), temp_dir)
-    rmtree(temp_dir, ignore_errors=True)
-
-    # Prepare git repository 1
-    repos_dir = os.path.join(temp_dir, 'repos')
-    os.makedirs(repos_dir)
-    os.chdir(repos_dir)
-    subprocess.check_call(['git', 'init', 'git1', '--initial-branch=master'])
-    os.chdir('git1')  # repos -> repos/git1
-    # Prepare DEPS file
-    deps = {
+    cwd = str(tmp_path)
+
+    # Prepare the independent git repositories concurrently
+    repos_dir = os.path.join(cwd, 'repos')
+    deps1 = {
         "sub1": {
             "type": "solution",
             "url": f"file://{cwd}/repos/git3/.git",
@@ -84,62 +79,44 @@ def test_sync_recursively_duplicated_source():
             "branch": "master"
         }
     }
-    with open('DEPS', 'w') as f:
-        f.write(f'deps = {json.dumps(deps)}')
-    subprocess.check_call(['git', 'add', '.'])
-    subprocess.check_call(['git', 'commit', '-m', 'test'])
-
-    # Prepare git repository 2
-    os.chdir('..')  # repos/git1 -> repos
-    subprocess.check_call(['git', 'init', 'git2', '--initial-branch=master'])
-    os.chdir('git2')  # repos -> repos/git2
-    # Prepare DEPS file
-    with open('test', 'w') as f:
-        f.write('test')
-    subprocess.check_call(['git', 'add', '.'])
-    subprocess.check_call(['git', 'commit', '-m', 'test'])
-
-    # Prepare git repository 3
-    os.chdir('..')  # repos/git2 -> repos
-    subprocess.check_call(['git', 'init', 'git3', '--initial-branch=master'])
-    os.chdir('git3')  # repos -> repos/git3
-    os.mkdir('subsub1')
-    with open(os.path.join('subsub1', 'test'), 'w') as f:
-        f.write('test')
-    # Prepare DEPS file
-    deps = {
+    deps3 = {
         "subsub2": {
             "type": "git",
             "url": f"file://{cwd}/repos/git2/.git",
             "branch": "master",
         }
     }
-    with open('DEPS', 'w') as f:
-        f.write(f'deps = {deps}')
-    subprocess.check_call(['git', 'add', '.'])
-    subprocess.check_call(['git', 'commit', '-m', 'test'])
+
+    async def prepare_repos():
+        await asyncio.gather(
+            prepare_repo(os.path.join(repos_dir, 'git1'), {'DEPS': f'deps = {json.dumps(deps1)}'}),
+            prepare_repo(os.path.join(repos_dir, 'git2'), {'test': 'test'}),
+            prepare_repo(
+                os.path.join(repos_dir, 'git3'), {os.path.join('subsub1', 'test'): 'test', 'DEPS': f'deps = {deps3}'}
+            ),
+        )
+
+    asyncio.run(prepare_repos())
 
     # Test sync
-    os.chdir('../..')  # repos/git3 -> .
+    main_dir = os.path.join(cwd, 'main')
     run_with_custom_argv(main, [
-        'hab', 'config', f'file://{cwd}/repos/git1/.git', 'main', '-b', 'master'
+        'hab', 'config', f'file://{cwd}/repos/git1/.git', main_dir, '-b', 'master'
     ])
 
     run_with_custom_argv(main, [
-        'hab', 'sync', 'main', '--main', '--disable-cache',
+        'hab', 'sync', main_dir, '--main', '--disable-cache',
     ])
 
     # Check result
-    assert os.path.isdir(os.path.join('main', 'sub1', 'subsub1'))
-    assert os.path.islink(os.path.join('main', 'sub1', 'subsub2'))
-    assert os.path.realpath(os.path.join('main', 'sub1', 'subsub2')) == os.path.realpath(os.path.join('main', 'sub2'))
-    assert os.path.isdir(os.path.join('main', 'sub2', '.git'))
-
-    os.chdir('..')
-    rmtree(temp_dir, ignore_errors=True)
+    assert os.path.isdir(os.path.join(main_dir, 'sub1', 'subsub1'))
+    assert os.path.islink(os.path.join(main_dir, 'sub1', 'subsub2'))
+    assert os.path.realpath(os.path.join(main_dir, 'sub1', 'subsub2')) == \
+        os.path.realpath(os.path.join(main_dir, 'sub2'))
+    assert os.path.isdir(os.path.join(main_dir, 'sub2', '.git'))
 
 
-def test_sync_recursively_targets_conflicts():
+def test_sync_recursively_targets_conflicts(tmp_path):
     """
     Independent repositories:
         main(git 1)
@@ -156,18 +133,11 @@ def test_sync_recursively_targets_conflicts():
          └── sub2(git 2)
     """
 
-    temp_dir = test_sync_recursively_targets_conflicts.__name__
-    cwd = os.path.join(os.getcwd(), temp_dir)
-    rmtree(temp_dir, ignore_errors=True)
-
-    # Prepare git repository 1
-    repos_dir = os.path.join(temp_dir, 'repos')
-    os.makedirs(repos_dir)
-    os.chdir(repos_dir)
-    subprocess.check_call(['git', 'init', 'git1', '--initial-branch=master'])
-    os.chdir('git1')  # repos -> repos/git1
-    # Prepare DEPS file
-    deps = {
+    cwd = str(tmp_path)
+
+    # Prepare the independent git repositories concurrently
+    repos_dir = os.path.join(cwd, 'repos')
+    deps1 = {
         "sub1": {
             "type": "solution",
             "url": f"file://{cwd}/repos/git3/.git",
@@ -179,57 +149,38 @@ def test_sync_recursively_targets_conflicts():
             "branch": "master"
         }
     }
-    with open('DEPS', 'w') as f:
-        f.write(f'deps = {json.dumps(deps)}')
-    subprocess.check_call(['git', 'add', '.'])
-    subprocess.check_call(['git', 'commit', '-m', 'test'])
-
-    # Prepare git repository 2
-    os.chdir('..')  # repos/git1 -> repos
-    subprocess.check_call(['git', 'init', 'git2', '--initial-branch=master'])
-    os.chdir('git2')  # repos -> repos/git2
-    # Prepare DEPS file
-    with open('test', 'w') as f:
-        f.write('test')
-    subprocess.check_call(['git', 'add', '.'])
-    subprocess.check_call(['git', 'commit', '-m', 'test'])
-
-    # Prepare git repository 3
-    os.chdir('..')  # repos/git2 -> repos
-    subprocess.check_call(['git', 'init', 'git3', '--initial-branch=master'])
-    os.chdir('git3')  # repos -> repos/git3
-    os.mkdir('subsub1')
-    with open(os.path.join('subsub1', 'test'), 'w') as f:
-        f.write('test')
-    # Prepare DEPS file
-    deps = {
+    deps3 = {
         "../sub1": {
             "type": "git",
             "url": f"file://{cwd}/repos/git4/.git",
             "branch": "master",
         }
     }
-    with open('DEPS', 'w') as f:
-        f.write(f'deps = {deps}')
-    subprocess.check_call(['git', 'add', '.'])
-    subprocess.check_call(['git', 'commit', '-m', 'test'])
+
+    async def prepare_repos():
+        await asyncio.gather(
+            prepare_repo(os.path.join(repos_dir, 'git1'), {'DEPS': f'deps = {json.dumps(deps1)}'}),
+            prepare_repo(os.path.join(repos_dir, 'git2'), {'test': 'test'}),
+            prepare_repo(
+                os.path.join(repos_dir, 'git3'), {os.path.join('subsub1', 'test'): 'test', 'DEPS': f'deps = {deps3}'}
+            ),
+        )
+
+    asyncio.run(prepare_repos())
 
     # Test sync
-    os.chdir('../..')  # repos/git3 -> .
+    main_dir = os.path.join(cwd, 'main')
     run_with_custom_argv(main, [
-        'hab', 'config', f'file://{cwd}/repos/git1/.git', 'main', '-b', 'master'
+        'hab', 'config', f'file://{cwd}/repos/git1/.git', main_dir, '-b', 'master'
     ])
 
     run_with_custom_argv(main, [
-        'hab', 'sync', 'main', '--main', '--disable-cache',
+        'hab', 'sync', main_dir, '--main', '--disable-cache',
     ])
 
     # Check result
-    assert os.path.isdir(os.path.join('main', 'sub1', 'subsub1'))
-    assert os.path.isdir(os.path.join('main', 'sub2', '.git'))
-
-    os.chdir('..')
-    rmtree(temp_dir, ignore_errors=True)
+    assert os.path.isdir(os.path.join(main_dir, 'sub1', 'subsub1'))
+    assert os.path.isdir(os.path.join(main_dir, 'sub2', '.git'))
 
 
 def disabled_test_sync_http_dependency(httpserver, default_repo):
@@ -264,8 +215,7 @@ def disabled_test_sync_http_dependency(httpserver, default_repo):
         'w'
     )
 
-    os.chdir(default_repo)
-    run_with_custom_argv(main, ['hab', 'sync', '.'])
+    run_with_custom_argv(main, ['hab', 'sync', default_repo])
 
     file_path = os.path.join(default_repo, 'http', 'hello.py')
     assert os.path.exists(file_path)
@@ -276,21 +226,19 @@ def disabled_test_sync_http_dependency(httpserver, default_repo):
 def test_sync_with_lfs(lfs_repo):
     # TODO(zouzhecheng): add a mock to check if git lfs pull was called
     main_repo_path, sha256 = lfs_repo
-    os.chdir(main_repo_path)
-    run_with_custom_argv(main, ['hab', 'sync', '.'])
+    run_with_custom_argv(main, ['hab', 'sync', main_repo_path])
 
     assert os.path.exists(os.path.join(main_repo_path, 'lfs', 'binary'))
-    with open(os.path.join(main_repo_path, 'lfs', 'binary'), 'rb') as f:
-        assert hashlib.sha256(f.read()).hexdigest() == sha256
+    # hashed in a stream, the binary is not read into memory at once
+    assert file_hexdigest(os.path.join(main_repo_path, 'lfs', 'binary'), 'sha256') == sha256
 
 
 def test_sync_target_only(tmp_path):
-    os.chdir(tmp_path)
-    cwd = os.getcwd()
+    cwd = str(tmp_path)
 
-    subprocess.check_call(['git', 'init', 'test-repo', '--initial-branch=master'])
-    subprocess.check_call(['git', 'init', 'base-deps', '--initial-branch=master'])
-    subprocess.check_call(['git', 'init', 'android-deps', '--initial-branch=master'])
+    init_git_repo(f'{cwd}/test-repo')
+    init_git_repo(f'{cwd}/base-deps')
+    init_git_repo(f'{cwd}/android-deps')
     solutions = [
         {
             'name': '.',
@@ -345,58 +293,27 @@ def test_sync_target_only(tmp_path):
 
 
 def test_sync_git_repo_with_patches(tmp_path):
-    os.chdir(tmp_path)
-    cwd = os.getcwd()
+    cwd = str(tmp_path)
 
-    subprocess.check_call(['git', 'init', 'lib', '--initial-branch=master'])
-    subprocess.check_call(['git', 'init', 'main', '--initial-branch=master'])
+    init_git_repo(f'{cwd}/lib')
+    init_git_repo(f'{cwd}/main')
 
-    first_commit = make_change_in_repo(
-        f'{cwd}/lib',
-        'hello.py',
-        'print("hello, world.")',
-        'add hello world',
-        'w'
-    )
-
-    make_change_in_repo(
-        f'{cwd}/lib',
-        'hello.py',
-        '\nprint("thanks!")',
-        'add thanks',
-        'a'
-    )
-
-    make_change_in_repo(
-        f'{cwd}/lib',
-        'hello.py',
-        'print("done")',
-        'done',
-        'w'
-    )
+    first_commit, *_ = make_changes_in_repo(f'{cwd}/lib', [
+        ('hello.py', 'print("hello, world.")', 'add hello world', 'w'),
+        ('hello.py', '\nprint("thanks!")', 'add thanks', 'a'),
+        ('hello.py', 'print("done")', 'done', 'w'),
+        ('hello.py', 'print("not yet")', 'not yet', 'w'),
+    ])
 
-    make_change_in_repo(
-        f'{cwd}/lib',
-        'hello.py',
-        'print("not yet")',
-        'not yet',
-        'w'
-    )
+    subprocess.check_call(['git', 'format-patch', 'HEAD^^^'], cwd=f'{cwd}/lib')
 
-    os.chdir('lib')
-    subprocess.check_call(['git', 'format-patch', 'HEAD^^^'])
-    os.chdir('..')
-
-    os.chdir('main')
-    os.makedirs('patches', exist_ok=True)
-    os.makedirs('other_patches', exist_ok=True)
-    os.chdir('..')
-    subprocess.check_call(['mv', f'{cwd}/lib/0001-add-thanks.patch', f'{cwd}/main/patches/0001-add-thanks.patch'])
-    subprocess.check_call(['mv', f'{cwd}/lib/0002-done.patch', f'{cwd}/main/patches/0002-done.patch'])
-    subprocess.check_call(['mv', f'{cwd}/lib/0003-not-yet.patch', f'{cwd}/main/other_patches/0003-not-yet.patch'])
-    os.chdir('main')
-    subprocess.check_call(['git', 'add', '.'])
-    subprocess.check_call(['git', 'commit', '-m', 'submit patches'])
+    os.makedirs(f'{cwd}/main/patches', exist_ok=True)
+    os.makedirs(f'{cwd}/main/other_patches', exist_ok=True)
+    os.replace(f'{cwd}/lib/0001-add-thanks.patch', f'{cwd}/main/patches/0001-add-thanks.patch')
+    os.replace(f'{cwd}/lib/0002-done.patch', f'{cwd}/main/patches/0002-done.patch')
+    os.replace(f'{cwd}/lib/0003-not-yet.patch', f'{cwd}/main/other_patches/0003-not-yet.patch')
+    subprocess.check_call(['git', 'add', '.'], cwd=f'{cwd}/main')
+    subprocess.check_call(['git', 'commit', '-m', 'submit patches'], cwd=f'{cwd}/main')
 
     solutions = [
         {
@@ -441,7 +358,7 @@ def test_sync_git_repo_with_patches(tmp_path):
         'w'
     )
 
-    run_with_custom_argv(main, ['hab', 'sync', '.'])
+    run_with_custom_argv(main, ['hab', 'sync', f'{cwd}/main'])
 
     assert os.path.exists(f'{cwd}/main/lib/hello.py')
     with open(f'{cwd}/main/lib/hello.py') as f:
@@ -454,10 +371,9 @@ def test_sync_git_repo_with_patches(tmp_path):
 
 @patch('core.main.DEBUG', True)
 def test_sync_dependency_with_cycled_requirement(tmp_path):
-    os.chdir(tmp_path)
-    cwd = os.getcwd()
-    subprocess.check_call(['git', 'init', 'dep', '--initial-branch=master'])
-    subprocess.check_call(['git', 'init', 'main-repo', '--initial-branch=master'])
+    cwd = str(tmp_path)
+    init_git_repo(f'{cwd}/dep')
+    init_git_repo(f'{cwd}/main-repo')
     solutions = [
         {
             'name': '.',
@@ -487,8 +403,48 @@ def test_sync_dependency_with_cycled_requirement(tmp_path):
     make_change_in_repo(
         f'{cwd}/main-repo', 'DEPS', generate_habitat_config_file('deps', deps), 'add DEPS', 'w'
     )
-    os.chdir('main-repo')
     try:
-        run_with_custom_argv(main, ['hab', 'sync', '.'])
+        run_with_custom_argv(main, ['hab', 'sync', f'{cwd}/main-repo'])
     except HabitatException as e:
         assert str(e) == "found a cicular dependency, please check test_b's requirement test_a."
+
+
+def test_sync_action_commands(tmp_path):
+    cwd = str(tmp_path)
+    init_git_repo(f'{cwd}/main-repo')
+    solutions = [
+        {
+            'name': '.',
+            'deps_file': 'DEPS',
+            'url': f'file://{cwd}/main-repo/.git',
+            'branch': 'master'
+        }
+    ]
+    deps = {
+        'action': {
+            'type': 'action',
+            'commands': [
+                'python -c "open(\'action.txt\', \'w\').close()"'
+            ]
+        }
+    }
+    make_change_in_repo(
+        f'{cwd}/main-repo', '.habitat', generate_habitat_config_file('solutions', solutions),
+        'add .habitat', 'w'
+    )
+    make_change_in_repo(
+        f'{cwd}/main-repo', 'DEPS', generate_habitat_config_file('deps', deps), 'add DEPS', 'w'
+    )
+    run_with_custom_argv(main, ['hab', 'sync', f'{cwd}/main-repo'])
+    assert os.path.exists(f'{cwd}/main-repo/action.txt')
+
+
+def test_group_solutions_by_nesting_level(tmp_path):
+    def solution(target_dir):
+        return SimpleNamespace(target_dir=tmp_path / target_dir)
+
+    root, first, second, nested, sibling = solutions = [
+        solution('.'), solution('shared'), solution('shared'), solution('shared/nested'), solution('sibling')
+    ]
+    # solutions sharing a target directory are never synced concurrently, they keep their order
+    assert group_by_nesting_level(solutions) == [[root], [first, sibling], [second], [nested]]
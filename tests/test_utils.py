@@ -1,52 +1,164 @@
+import asyncio
 import os
 import shutil
-from pathlib import Path
+import stat
+from unittest.mock import patch
+from zipfile import ZIP_STORED, BadZipFile, ZipFile, ZipInfo
 
-from core.utils import extract_archive
+import pytest
 
+import core.utils
+from core.exceptions import HabitatException
+from core.utils import async_check_call, extract_archive, get_full_commit_id, rmtree
+from utils import init_git_repo, make_change_in_repo
 
-def test_extract_archive(tmp_path):
-    artifact_path = os.path.join(tmp_path, 'test_extract_archive_artifact')
 
-    # prepare a file with mode 777 and a dir with mode 711
-    with open(test_file := f'{tmp_path}/test-file', 'w') as f:
-        f.write('test')
-    os.chmod(test_file, mode=0o777)
-    os.makedirs(test_dir := f'{tmp_path}/test-dir', mode=0o711)
+@pytest.mark.parametrize('archive_format', ['gztar', 'zip', 'xztar', 'bztar', 'tar'])
+def test_extract_archive(tmp_path, archives, archive_format):
+    # the archives of a file with mode 777 and a dir with mode 711 are shared by the session
+    archive_paths, origin_file_stat, origin_dir_stat = archives
 
-    origin_file_stat = os.stat(test_file).st_mode
-    origin_dir_stat = os.stat(test_dir).st_mode
-
-    # make archive
-    os.chdir(tmp_path)
-    shutil.make_archive(f'{artifact_path}/archive', 'gztar')
-    shutil.make_archive(f'{artifact_path}/archive', 'zip')
-    shutil.make_archive(f'{artifact_path}/archive', 'xztar')
-    shutil.make_archive(f'{artifact_path}/archive', 'bztar')
-    shutil.make_archive(f'{artifact_path}/archive', 'tar')
-
-    # extract archive
-    extract_archive(f'{artifact_path}/archive.tar.gz', f'{artifact_path}/gz', [])
-    extract_archive(f'{artifact_path}/archive.zip', f'{artifact_path}/zip', [])
-    extract_archive(f'{artifact_path}/archive.tar.xz', f'{artifact_path}/xz', [])
-    extract_archive(f'{artifact_path}/archive.tar.bz2', f'{artifact_path}/bz', [])
-    extract_archive(f'{artifact_path}/archive.tar', f'{artifact_path}/tar', [])
+    # extract a copy of the archive, extract_archive deletes the archive
+    archive = os.path.join(tmp_path, os.path.basename(archive_paths[archive_format]))
+    shutil.copyfile(archive_paths[archive_format], archive)
+    extract_archive(archive, f'{tmp_path}/output', [])
 
     # assert mode equals with the original mode
-    assert os.stat(f'{artifact_path}/gz/test-dir').st_mode == origin_dir_stat
-    assert os.stat(f'{artifact_path}/gz/test-file').st_mode == origin_file_stat
-    assert os.stat(f'{artifact_path}/zip/test-dir').st_mode == origin_dir_stat
-    assert os.stat(f'{artifact_path}/zip/test-file').st_mode == origin_file_stat
-    assert os.stat(f'{artifact_path}/xz/test-dir').st_mode == origin_dir_stat
-    assert os.stat(f'{artifact_path}/xz/test-file').st_mode == origin_file_stat
-    assert os.stat(f'{artifact_path}/bz/test-dir').st_mode == origin_dir_stat
-    assert os.stat(f'{artifact_path}/bz/test-file').st_mode == origin_file_stat
-    assert os.stat(f'{artifact_path}/tar/test-dir').st_mode == origin_dir_stat
-    assert os.stat(f'{artifact_path}/tar/test-file').st_mode == origin_file_stat
+    assert os.stat(f'{tmp_path}/output/test-dir').st_mode == origin_dir_stat
+    assert os.stat(f'{tmp_path}/output/test-file').st_mode == origin_file_stat
+
     # assert archive file is deleted
+    assert not os.path.exists(archive)
+
+
+def test_extract_truncated_tarfile(tmp_path, archives):
+    archive_paths, _, _ = archives
+    archive = os.path.join(tmp_path, os.path.basename(archive_paths['gztar']))
+    with open(archive_paths['gztar'], 'rb') as f:
+        content = f.read()
+    with open(archive, 'wb') as f:
+        f.write(content[:len(content) // 2])
+
+    with pytest.raises(HabitatException, match='tar exited with'):
+        extract_archive(archive, f'{tmp_path}/output', [])
+
+
+def test_rmtree_refuses_symlink(tmp_path):
+    target = tmp_path / 'target'
+    (target / 'dir').mkdir(parents=True)
+    (target / 'dir' / 'file').write_text('test')
+    link = tmp_path / 'link'
+    link.symlink_to(target, target_is_directory=True)
+
+    with pytest.raises(OSError):
+        rmtree(str(link))
+
+    # neither the link nor anything in its target is removed
+    assert link.is_symlink()
+    assert (target / 'dir' / 'file').read_text() == 'test'
+
+
+def test_rmtree_read_only_entries(tmp_path):
+    outside = tmp_path / 'outside'
+    outside.mkdir()
+    (outside / 'file').write_text('test')
+    outside_mode = outside.stat().st_mode
+
+    root = tmp_path / 'root'
+    (root / 'read-only-dir' / 'unreadable-dir').mkdir(parents=True)
+    read_only_files = [
+        root / 'read-only-file', root / 'read-only-dir' / 'file', root / 'read-only-dir' / 'unreadable-dir' / 'file'
+    ]
+    for path in read_only_files:
+        path.write_text('test')
+        path.chmod(0o444)
+    (root / 'link').symlink_to(outside, target_is_directory=True)
+    (root / 'read-only-dir' / 'unreadable-dir').chmod(0o000)
+    (root / 'read-only-dir').chmod(0o555)
+
+    rmtree(str(root))
+
+    assert not root.exists()
+    # the symlinked directory is unlinked, not walked
+    assert (outside / 'file').read_text() == 'test'
+    assert outside.stat().st_mode == outside_mode
+
+
+def test_get_full_commit_id_cache(tmp_path):
+    repo_dir = os.path.join(tmp_path, 'repo')
+    init_git_repo(repo_dir)
+    full_id = make_change_in_repo(repo_dir, 'test', 'test', 'test', 'w')
+    url = f'file://{repo_dir}/.git'
+    cache_dir = tmp_path / 'cache'
+
+    # without a cache directory nothing is written to disk
+    assert get_full_commit_id(full_id[:8], url) == full_id
+    assert get_full_commit_id(full_id[:8], url, str(cache_dir)) == full_id
+    assert [path.name for path in cache_dir.glob('commits/*/*')] == [full_id[:8]]
+
+    # a cached id is resolved without asking the remote
+    with patch('core.utils._ls_remote', side_effect=AssertionError):
+        assert get_full_commit_id(full_id[:8], url, str(cache_dir)) == full_id
+
+
+def _create_stored_zip(path):
+    with ZipFile(path, 'w', compression=ZIP_STORED) as z:
+        z.writestr('dir/', '')
+        z.writestr('dir/nested/file', 'stored file')
+        z.writestr('top', b'top file' * 1024)
+        link = ZipInfo('dir/link')
+        link.external_attr = (stat.S_IFLNK | 0o777) << 16
+        z.writestr(link, 'nested/file')
+
+
+def test_extract_stored_zip(tmp_path):
+    archive = os.path.join(tmp_path, 'stored.zip')
+    _create_stored_zip(archive)
+
+    with patch('core.utils._sendfile_member', wraps=core.utils._sendfile_member) as sendfile_member:
+        extract_archive(archive, f'{tmp_path}/output', [])
+    if core.utils._SENDFILE_TO_FILE:
+        assert sendfile_member.call_count == 2
+
+    assert (tmp_path / 'output' / 'dir' / 'nested' / 'file').read_text() == 'stored file'
+    assert (tmp_path / 'output' / 'top').read_bytes() == b'top file' * 1024
+    assert os.readlink(tmp_path / 'output' / 'dir' / 'link') == 'nested/file'
+    assert (tmp_path / 'output' / 'dir' / 'link').read_text() == 'stored file'
+    assert not os.path.exists(archive)
+
+
+def test_extract_corrupt_stored_zip(tmp_path):
+    archive = os.path.join(tmp_path, 'stored.zip')
+    _create_stored_zip(archive)
+    with open(archive, 'r+b') as f:
+        data = f.read()
+        f.seek(data.index(b'stored file'))
+        f.write(b'STORED')
+
+    with pytest.raises(BadZipFile):
+        extract_archive(archive, f'{tmp_path}/output', [])
+
+
+def _is_running(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # the parent of an orphan may never reap it, a zombie is not running
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc'), reason='needs procfs')
+def test_cancel_shell_command(tmp_path):
+    pid_file = tmp_path / 'pid'
+
+    async def run():
+        task = asyncio.ensure_future(async_check_call(f'sleep 60 & echo $! > {pid_file}; wait', shell=True))
+        while not pid_file.exists() or not pid_file.read_text().strip():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
 
-    assert not list(Path(artifact_path).glob('*.tar.gz'))
-    assert not list(Path(artifact_path).glob('*.zip'))
-    assert not list(Path(artifact_path).glob('*.tar.xz'))
-    assert not list(Path(artifact_path).glob('*.tar'))
-    assert not list(Path(artifact_path).glob('*.tar.bz2'))
+    asyncio.run(run())
+    assert not _is_running(int(pid_file.read_text()))
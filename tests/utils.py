@@ -1,11 +1,31 @@
 import asyncio
+import atexit
+import functools
 import hashlib
 import os
+import random
+import shutil
 import subprocess
 import sys
+import tempfile
 from io import BytesIO
+from pathlib import Path
 from unittest.mock import patch
-from zipfile import ZipFile
+from zipfile import ZIP_STORED, ZipFile
+
+
+@functools.lru_cache(maxsize=1)
+def _git_skeleton():
+    # one empty repository per test session, without the sample hooks of the default template
+    skeleton_dir = tempfile.mkdtemp(prefix='habitat-git-skeleton-')
+    atexit.register(shutil.rmtree, skeleton_dir, ignore_errors=True)
+    subprocess.check_call(['git', 'init', '-q', '--template=', '--initial-branch=master', skeleton_dir])
+    return os.path.join(skeleton_dir, '.git')
+
+
+def init_git_repo(repo_dir: str):
+    """Create an empty git repository on branch master at repo_dir by copying a prepared .git directory."""
+    shutil.copytree(_git_skeleton(), os.path.join(repo_dir, '.git'))
 
 
 def run_with_custom_argv(func, argv):
@@ -18,8 +38,9 @@ def async_run_with_custom_argv(func, argv):
         asyncio.run(func())
 
 
-def create_test_binary_resource(size: int = 1 * 1024 * 1024, return_bytes_only: bool = False):
-    c = os.urandom(size)
+def create_test_binary_resource(size: int = 1 * 1024 * 1024, return_bytes_only: bool = False, seed: int = 0xCAFEBABE):
+    # a seeded prng is much cheaper than the kernel csprng and makes the resource and its hash reproducible
+    c = random.Random(seed).randbytes(size)
     h = hashlib.sha256(c).hexdigest()
     if not return_bytes_only:
         return c, h
@@ -28,19 +49,97 @@ def create_test_binary_resource(size: int = 1 * 1024 * 1024, return_bytes_only:
 
 def create_zip_file():
     io = BytesIO()
-    with ZipFile(io, 'w') as f:
+    with ZipFile(io, 'w', compression=ZIP_STORED) as f:
         f.writestr('hello.py', 'print("hello")')
 
-    return io.getvalue(), len(io.getvalue()), hashlib.sha256(io.getvalue()).hexdigest()
+    data = io.getvalue()
+    return data, len(data), hashlib.sha256(data).hexdigest()
+
+
+def head_commit_id(repo_dir: str):
+    # a fresh commit updates the loose ref of the current branch, read it instead of running git rev-parse
+    git_dir = os.path.join(repo_dir, '.git')
+    with open(os.path.join(git_dir, 'HEAD')) as f:
+        head = f.read().strip()
+    if not head.startswith('ref: '):
+        return head
+    ref_path = os.path.join(git_dir, head[len('ref: '):])
+    if os.path.isfile(ref_path):
+        with open(ref_path) as f:
+            return f.read().strip()
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=repo_dir).decode().strip()
 
 
 def make_change_in_repo(repo_dir: str, file_path: str, content: str, commit_message: str, mode: str):
     with open(os.path.join(repo_dir, file_path), mode) as f:
         f.write(content)
     subprocess.check_call(['git', 'add', file_path], cwd=repo_dir)
-    subprocess.check_call(['git', 'commit', '-m', f'"{commit_message}"'], cwd=repo_dir)
-    commit_id = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=repo_dir).decode().strip()
-    return commit_id
+    subprocess.check_call(['git', 'commit', '-q', '-m', commit_message], cwd=repo_dir)
+    return head_commit_id(repo_dir)
+
+
+def make_changes_in_repo(repo_dir: str, changes: list):
+    """
+    Commit a list of changes, each a tuple of the file_path, content, commit_message and mode arguments of
+    make_change_in_repo, one commit per change. All commits are written by a single git fast-import on the current
+    branch and the work tree is reset to the last one. Returns the commit ids.
+    """
+    git_dir = os.path.join(repo_dir, '.git')
+    with open(os.path.join(git_dir, 'HEAD')) as f:
+        branch = f.read().strip()[len('ref: '):]
+
+    stream = []
+    contents = {}
+    for i, (file_path, content, commit_message, mode) in enumerate(changes, 1):
+        if mode == 'a':
+            if file_path not in contents:
+                work_tree_file = os.path.join(repo_dir, file_path)
+                contents[file_path] = Path(work_tree_file).read_text() if os.path.exists(work_tree_file) else ''
+            content = contents[file_path] + content
+        contents[file_path] = content
+
+        message, data = commit_message.encode(), content.encode()
+        stream += [
+            f'commit {branch}'.encode(),
+            f'mark :{i}'.encode(),
+            f'committer habitat <habitat@example.com> {1700000000 + i} +0000'.encode(),
+            f'data {len(message)}'.encode(), message,
+        ]
+        if i == 1 and os.path.isfile(os.path.join(git_dir, branch)):
+            stream.append(f'from {branch}^0'.encode())
+        stream += [f'M 100644 inline {file_path}'.encode(), f'data {len(data)}'.encode(), data, b'']
+
+    marks_file = os.path.join(git_dir, 'habitat-fast-import-marks')
+    subprocess.run(
+        ['git', 'fast-import', '--quiet', f'--export-marks={marks_file}'], input=b'\n'.join(stream), cwd=repo_dir,
+        check=True
+    )
+    subprocess.check_call(['git', 'reset', '-q', '--hard'], cwd=repo_dir)
+    with open(marks_file) as f:
+        marks = dict(line.split() for line in f)
+    os.remove(marks_file)
+    return [marks[f':{i}'] for i in range(1, len(changes) + 1)]
+
+
+async def _check_call_async(*args, cwd=None):
+    proc = await asyncio.create_subprocess_exec(*args, cwd=cwd)
+    if await proc.wait():
+        raise subprocess.CalledProcessError(proc.returncode, args)
+
+
+async def prepare_repo(repo_dir: str, files: dict, commit_message: str = 'test'):
+    """
+    Init a git repository at repo_dir and commit files, a dict of relative path to content, to it. Independent
+    repositories can be prepared concurrently with asyncio.gather.
+    """
+    init_git_repo(repo_dir)
+    for file_path, content in files.items():
+        file_path = os.path.join(repo_dir, file_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w') as f:
+            f.write(content)
+    await _check_call_async('git', 'add', '.', cwd=repo_dir)
+    await _check_call_async('git', 'commit', '-m', commit_message, cwd=repo_dir)
 
 
 def generate_habitat_config_file(config_name: str, config):